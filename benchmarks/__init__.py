@@ -0,0 +1,4 @@
+"""
+Package: benchmarks
+Scripts that measure the service against a real database
+"""
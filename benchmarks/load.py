@@ -0,0 +1,234 @@
+"""
+Load Generator
+
+Drives a running instance of the service over HTTP with a mix of calls
+from concurrent clients, each on its own keep-alive connection, and
+reports the latency percentiles and requests per second of each kind of
+call and of all of them. Orders for the reads and cancels are created
+first, under a random user_id, and all the Orders of that user are
+deleted at the end.
+
+Only the standard library is used, and the service package is not
+imported, so it can run from any machine that reaches the service.
+
+Usage:
+    python -m benchmarks.load [--url http://localhost:8080] [--concurrency 8]
+                              [--duration 30] [--mix list=60,read=25,create=10,cancel=5]
+                              [--orders 500] [--save RESULTS.json]
+
+Compare a saved run with a baseline with python -m benchmarks.results.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.parse import urlsplit
+from benchmarks.results import format_table, report, save, summarize
+
+CALLS = ("list", "read", "create", "cancel")
+JSON_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+
+
+def parse_mix(text):
+    """Returns the (calls, weights) of a mix such as "list=60,read=40" """
+    calls, weights = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in CALLS:
+            raise argparse.ArgumentTypeError(f"unknown call {name!r}, use {', '.join(CALLS)}")
+        try:
+            weight = float(weight)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(f"bad weight for {name}: {weight!r}") from error
+        if weight > 0:
+            calls.append(name)
+            weights.append(weight)
+    if not calls:
+        raise argparse.ArgumentTypeError("the mix needs at least one call")
+    return calls, weights
+
+
+def order_payload(user_id, items=2):
+    """Returns the body of a NEW Order with random values, like OrderFactory's"""
+    return {
+        "name": f"Load Test {random.randint(1, 10**6)}",
+        "create_time": datetime.now(timezone.utc).isoformat(),
+        "address": f"{random.randint(1, 9999)} Main Street\nNew York, NY 10001",
+        "cost_amount": round(random.uniform(1, 1000), 2),
+        "status": "NEW",
+        "user_id": user_id,
+        "items": [
+            {
+                "order_id": 0,
+                "title": random.choice(["iPhone15", "MacBook Pro", "iPad Pro"]),
+                "amount": random.randint(1, 10),
+                "price": round(random.uniform(1, 1000), 2),
+                "product_id": str(random.randint(1000, 5000)),
+                "status": "INSTOCK",
+            }
+            for _ in range(items)
+        ],
+    }
+
+
+class Client:
+    """One keep-alive connection to the service"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.prefix = parts.path.rstrip("/")
+
+    def request(self, method, path, body=None):
+        """Sends a request and returns (status, body), reading the whole body"""
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        try:
+            self.connection.request(method, self.prefix + path, data, JSON_HEADERS)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, HTTPException):
+            self.connection.close()  # reconnects on the next request
+            return None, b""
+
+    def close(self):
+        """Closes the connection"""
+        self.connection.close()
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """Runs a mix of calls against the service and collects their latencies"""
+
+    def __init__(self, args):
+        self.args = args
+        self.calls, self.weights = args.mix
+        self.user_id = random.randint(10**8, 10**9)
+        self.page = f"/orders?user_id={self.user_id}&limit=100"
+        self.ids = []  # Orders to read
+        self.cancelable = []  # NEW Orders no client canceled yet
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def seed(self):
+        """Creates the Orders the reads and cancels pick from"""
+        client = Client(self.args.url)
+        for start in range(0, self.args.orders, 500):
+            count = min(500, self.args.orders - start)
+            body = [order_payload(self.user_id) for _ in range(count)]
+            code, data = client.request("POST", "/orders/bulk", body)
+            if code != 201:
+                raise SystemExit(f"Could not seed Orders: {code} {data[:200]!r}")
+            self.ids.extend(result["id"] for result in json.loads(data))
+        client.close()
+        self.cancelable = list(self.ids)
+        random.shuffle(self.cancelable)
+
+    def call(self, client, name):
+        """Makes one call and returns its (status, expected status)"""
+        if name == "list":
+            return client.request("GET", self.page)[0], 200
+        if name == "read":
+            return client.request("GET", f"/orders/{random.choice(self.ids)}")[0], 200
+        if name == "create":
+            code, data = client.request("POST", "/orders", order_payload(self.user_id))
+            if code == 201:
+                order_id = json.loads(data)["id"]
+                with self.lock:
+                    self.ids.append(order_id)
+                    self.cancelable.append(order_id)
+            return code, 201
+        with self.lock:
+            order_id = self.cancelable.pop() if self.cancelable else random.choice(self.ids)
+        return client.request("PUT", f"/orders/{order_id}/cancel")[0], 200
+
+    def worker(self, deadline):
+        """Makes calls from the mix until the deadline"""
+        client = Client(self.args.url)
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        while time.perf_counter() < deadline:
+            name = random.choices(self.calls, self.weights)[0]
+            start = time.perf_counter()
+            code, expected = self.call(client, name)
+            latencies[name].append(time.perf_counter() - start)
+            errors[name] += code != expected
+        client.close()
+        with self.lock:
+            for name, values in latencies.items():
+                self.latencies[name].extend(values)
+                self.errors[name] += errors[name]
+
+    def run(self):
+        """Runs the clients for the duration and returns the summaries by call"""
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        threads = [
+            threading.Thread(target=self.worker, args=(deadline,))
+            for _ in range(self.args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        results = {
+            name: summarize(self.latencies[name], elapsed, self.errors[name])
+            for name in self.calls
+        }
+        everything = [value for name in self.calls for value in self.latencies[name]]
+        results["all"] = summarize(everything, elapsed, sum(self.errors.values()))
+        return results
+
+    def clean_up(self):
+        """Deletes every Order of the test user"""
+        client = Client(self.args.url)
+        client.request("DELETE", f"/orders?user_id={self.user_id}")
+        client.close()
+
+
+def main():
+    """Seeds the Orders, runs the load and cleans up"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--url", default="http://localhost:8080", help="base URL of the service")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients (default 8)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load (default 30)")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="list=60,read=25,create=10,cancel=5",
+        help="weights of the calls (default list=60,read=25,create=10,cancel=5)",
+    )
+    parser.add_argument("--orders", type=int, default=500, help="Orders to seed (default 500)")
+    parser.add_argument("--save", metavar="RESULTS.json", help="write the results to a JSON file")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    test.seed()
+    try:
+        results = test.run()
+    finally:
+        test.clean_up()
+
+    print(f"{args.url}: {args.concurrency} clients for {args.duration:g}s")
+    print(format_table(results))
+    if args.save:
+        calls, weights = args.mix
+        settings = {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": dict(zip(calls, weights)),
+            "orders": args.orders,
+        }
+        save(args.save, report("load", settings, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Micro-benchmarks
+
+Times Order.serialize() and deserialize() on Orders from the test
+factories, and the main route handlers through the Flask test client
+against the database given by DATABASE_URI, without a network or a WSGI
+server in the way. Each benchmark calls its target --number times and
+reports the latency percentiles and calls per second.
+
+Usage:
+    python -m benchmarks.micro [--orders 1000] [--items 3] [--number 500]
+                               [--save RESULTS.json]
+
+Compare a saved run with a baseline with python -m benchmarks.results.
+"""
+import argparse
+import random
+import time
+from service import app
+from service.models import Order, OrderStatus, db
+from tests.factories import ItemFactory, OrderFactory
+from benchmarks.results import format_table, report, save, summarize
+
+
+def make_order(items, user_id, order_status=OrderStatus.NEW):
+    """Returns a new Order with items Items from the factories"""
+    order = OrderFactory(user_id=user_id, status=order_status)
+    order.items = [ItemFactory(order=None) for _ in range(items)]
+    return order
+
+
+def seed(count, items, user_id):
+    """Creates count NEW Orders with items Items each and returns their ids"""
+    ids = Order.bulk_create([make_order(items, user_id) for _ in range(count)])
+    db.session.expunge_all()
+    return ids
+
+
+def measure(function, arguments):
+    """Calls function once per argument and returns the summary of the calls"""
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for argument in arguments:
+        begin = time.perf_counter()
+        succeeded = function(argument)
+        latencies.append(time.perf_counter() - begin)
+        errors += succeeded is False
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def checked(response, code):
+    """Tells if a test client response has the expected status code"""
+    return response.status_code == code
+
+
+def run(args, user_id):
+    """Runs every benchmark and returns their summaries by name"""
+    client = app.test_client()
+    ids = seed(args.orders, args.items, user_id)
+    order = make_order(args.items, user_id)
+    order.id = 0
+    payload = order.serialize()
+    number = range(args.number)
+
+    results = {
+        "Order.serialize": measure(lambda _: order.serialize(), number),
+        "Order.deserialize": measure(lambda _: Order().deserialize(payload), number),
+        "GET /orders": measure(
+            lambda _: checked(client.get(f"/orders?user_id={user_id}&limit=100"), 200), number
+        ),
+        "GET /orders/<id>": measure(
+            lambda order_id: checked(client.get(f"/orders/{order_id}"), 200),
+            [random.choice(ids) for _ in number],
+        ),
+        "POST /orders": measure(lambda _: checked(client.post("/orders", json=payload), 201), number),
+        "PUT /orders/<id>/cancel": measure(
+            lambda order_id: checked(client.put(f"/orders/{order_id}/cancel"), 200),
+            random.sample(ids, min(args.number, len(ids))),
+        ),
+    }
+    return results
+
+
+def main():
+    """Seeds the Orders, runs the benchmarks and cleans up"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--orders", type=int, default=1000, help="Orders to seed (default 1000)")
+    parser.add_argument("--items", type=int, default=3, help="Items per Order (default 3)")
+    parser.add_argument("--number", type=int, default=500, help="calls per benchmark (default 500)")
+    parser.add_argument("--save", metavar="RESULTS.json", help="write the results to a JSON file")
+    args = parser.parse_args()
+
+    app.logger.setLevel("WARNING")
+    user_id = random.randint(10**8, 10**9)
+    try:
+        results = run(args, user_id)
+    finally:
+        Order.query.filter(Order.user_id == user_id).delete()
+        db.session.commit()
+
+    print(f"{args.orders} orders x {args.items} items, {args.number} calls each")
+    print(format_table(results))
+    if args.save:
+        settings = {"orders": args.orders, "items": args.items, "number": args.number}
+        save(args.save, report("micro", settings, results))
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        main()
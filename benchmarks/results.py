@@ -0,0 +1,147 @@
+"""
+Benchmark Results
+
+Summarizes the latencies measured by the benchmarks (p50/p95/p99 and
+requests per second), saves them as JSON with the commit they were taken
+on, and compares two saved runs so a change can be checked against a
+baseline.
+
+Usage:
+    python -m benchmarks.results BASELINE.json CURRENT.json [--threshold 10]
+
+The comparison exits with status 1 when a latency percentile got slower,
+or the throughput lower, by more than threshold percent.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+# Metrics compared across runs, and whether a higher value is better
+COMPARED = (("rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False))
+
+
+def percentile(values, fraction):
+    """Returns a percentile of sorted values, interpolating between ranks"""
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * fraction
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Returns the summary of one benchmark
+
+    Args:
+        latencies (list): the duration of each call in seconds
+        elapsed (float): the wall clock time of all of the calls in seconds
+        errors (int): how many of the calls failed
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def git_commit():
+    """Returns the commit the benchmarks run on, or None outside a git checkout"""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def report(benchmark, settings, results):
+    """Returns a run of a benchmark as a JSON serializable dictionary"""
+    return {
+        "benchmark": benchmark,
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": settings,
+        "results": results,
+    }
+
+
+def save(path, run):
+    """Writes a run to a JSON file"""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(run, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def load(path):
+    """Reads a run from a JSON file"""
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def format_table(results):
+    """Returns the summaries of a run as a text table"""
+    lines = [
+        f"{'':<28}{'requests':>9}{'errors':>8}{'req/s':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    ]
+    for name, summary in results.items():
+        lines.append(
+            f"{name:<28}{summary['requests']:>9}{summary['errors']:>8}{summary['rps']:>10.1f}"
+            f"{summary['mean_ms']:>9.2f}{summary['p50_ms']:>9.2f}{summary['p95_ms']:>9.2f}{summary['p99_ms']:>9.2f}"
+        )
+    lines.append("(latencies in ms)")
+    return "\n".join(lines)
+
+
+def compare(baseline, current, threshold):
+    """Compares the results two runs have in common
+
+    Returns:
+        a list of (name, metric, before, after, change in percent, regressed)
+    """
+    rows = []
+    for name, after in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            if not before[metric]:
+                continue
+            change = (after[metric] - before[metric]) / before[metric] * 100
+            worse = -change if higher_is_better else change
+            rows.append((name, metric, before[metric], after[metric], change, worse > threshold))
+    return rows
+
+
+def main():
+    """Prints the comparison of two runs and fails on a regression"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent (default 10)")
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    print(f"{baseline['benchmark']}: {baseline['commit']} -> {current['commit']}")
+    rows = compare(baseline, current, args.threshold)
+    for name, metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {name:<28}{metric:<8}{before:>10.2f}{after:>10.2f}{change:>+8.1f}%{flag}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
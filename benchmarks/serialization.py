@@ -0,0 +1,103 @@
+"""
+Serialization Benchmark
+
+Compares the ORM path that GET /orders used to take (load Orders and
+Items as ORM objects, serialize() them, jsonify() the result) with the
+column projection path (plain rows, serialize_rows(), fast_json) on a
+set of seeded Orders in the database given by DATABASE_URI.
+
+Usage:
+    python -m benchmarks.serialization [--orders 10000] [--items 3] [--repeat 5]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from flask import jsonify
+from service import app
+from service.common.encoders import load_encoder
+from service.models import Item, ItemStatus, Order, OrderStatus, db
+
+
+def seed(count, items, user_id):
+    """Creates count Orders with items Items each for user_id"""
+    now = datetime.now(timezone.utc)
+    orders = []
+    for number in range(count):
+        order = Order(
+            name=f"Customer {number}",
+            create_time=now - timedelta(seconds=number),
+            address=f"{number} Main Street\nNew York, NY 10001",
+            cost_amount=round(random.uniform(1, 1000), 2),
+            status=random.choice(list(OrderStatus)),
+            user_id=user_id,
+            items=[
+                Item(
+                    title=f"Product {number}-{position}",
+                    amount=random.randint(1, 5),
+                    price=round(random.uniform(1, 500), 2),
+                    product_id=str(random.randint(1000, 9999)),
+                    status=random.choice(list(ItemStatus)),
+                )
+                for position in range(items)
+            ],
+        )
+        orders.append(order)
+    Order.bulk_create(orders)
+    db.session.expunge_all()
+
+
+def orm_path(user_id, count):
+    """Returns the GET /orders body built from ORM objects"""
+    query = Order.with_items().filter(Order.user_id == user_id)
+    orders = Order.keyset_page(query, count)
+    body = jsonify([order.serialize() for order in orders]).data
+    db.session.rollback()  # drop the identity map like the end of a request
+    return body
+
+
+def row_path(user_id, count, encoder):
+    """Returns the GET /orders body built from column rows"""
+    query = Order.query.filter(Order.user_id == user_id)
+    rows = Order.keyset_rows(query, count).all()
+    body = encoder.dumps(Order.serialize_rows(rows)) + b"\n"
+    db.session.rollback()
+    return body
+
+
+def best_of(repeat, function, *args):
+    """Returns the fastest of repeat runs of function and its result"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    """Seeds the Orders, times each path and cleans up"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    user_id = random.randint(10**8, 10**9)
+    seed(args.orders, args.items, user_id)
+    try:
+        baseline, expected = best_of(args.repeat, orm_path, user_id, args.orders)
+        print(f"{args.orders} orders x {args.items} items, best of {args.repeat}")
+        print(f"  orm + jsonify       {baseline * 1000:9.1f} ms")
+        for name in ("stdlib", "orjson"):
+            elapsed, body = best_of(args.repeat, row_path, user_id, args.orders, load_encoder(name))
+            same = "same bytes" if body == expected else "DIFFERENT BYTES"
+            print(f"  rows + {name:<12} {elapsed * 1000:9.1f} ms  {baseline / elapsed:5.1f}x  {same}")
+    finally:
+        Order.query.filter(Order.user_id == user_id).delete()
+        db.session.commit()
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        main()
@@ -0,0 +1,14 @@
+"""
+Gunicorn settings
+
+gunicorn reads this file from the working directory on start up.
+"""
+import os
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live gauges of a worker that exited from the shared metrics"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+        multiprocess.mark_process_dead(worker.pid)
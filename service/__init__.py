@@ -8,6 +8,11 @@ import sys
 from flask import Flask
 from service import config
 from service.common import log_handlers
+from service.common import metrics, pooling, sql_stats
+from service.common.compression import compressor
+from service.common.cache import order_cache
+from service.common.encoders import fast_json
+from service.common.idempotency import idempotency_cache
 
 # Create Flask application
 app = Flask(__name__)
@@ -26,6 +31,11 @@ app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
+order_cache.init_app(app)
+idempotency_cache.init_app(app)
+fast_json.init_app(app)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pooling.engine_options(app.config)
+
 try:
     models.init_db(app)  # make our SQLAlchemy tables
 except Exception as error:  # pylint: disable=broad-except
@@ -33,4 +43,8 @@ except Exception as error:  # pylint: disable=broad-except
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+sql_stats.init_app(app)
+metrics.init_app(app, models.db)
+compressor.init_app(app)  # registered last so it runs first after a request
+
 app.logger.info("Service initialized!")
@@ -0,0 +1,68 @@
+"""
+Bulk Helpers
+
+This module contains utility functions to read and process large
+request bodies a chunk at a time, and to write rows with COPY
+"""
+import io
+import json
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_ndjson(stream):
+    """Yields (line number, object) pairs from a newline delimited JSON stream
+
+    Blank lines are skipped. A line that is not valid JSON yields a
+    ValueError in place of the object, so the caller can report it
+    against its line number and carry on with the rest of the stream.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, ValueError(f"Invalid JSON: {error}")
+
+
+def copy_text(rows):
+    """Returns rows in the text format of COPY FROM STDIN"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(escape(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def escape(value):
+    """Escapes a value for the text format of COPY, None being NULL"""
+    if value is None:
+        return "\\N"
+    text = str(value)
+    if "\\" in text or "\t" in text or "\n" in text or "\r" in text:
+        text = (
+            text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+        )
+    return text
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Writes rows into a table with COPY, with psycopg2 or psycopg 3"""
+    statement = f'COPY "{table}" ({", ".join(columns)}) FROM STDIN'
+    data = copy_text(rows)
+    if hasattr(cursor, "copy_expert"):  # psycopg2
+        cursor.copy_expert(statement, data)
+    else:  # psycopg 3
+        with cursor.copy(statement) as copy:
+            copy.write(data.getvalue())
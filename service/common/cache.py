@@ -0,0 +1,232 @@
+"""
+Order Cache
+
+This module contains a read-through cache for serialized Orders. The
+backend is chosen with CACHE_BACKEND:
+
+    lru     - a bounded LRU with a TTL inside each worker process (default)
+    shared  - a key/value store shared by every worker, given by CACHE_URL
+              (redis://... needs the redis package, memory:// is an
+              in-process stand-in for tests)
+    none    - caching is turned off
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+
+class LRUCache:
+    """A bounded, thread safe LRU cache whose entries expire after a TTL"""
+
+    name = "lru"
+
+    def __init__(self, maxsize=1024, ttl=30.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored under key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Stores value under key, evicting the least recently used entry"""
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Removes key from the cache"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the counters of the cache"""
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+class InMemoryStore:
+    """A stand-in for a Redis client that keeps its keys in this process
+
+    Only the get/set/delete/scan_iter calls used by SharedCache are provided.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value of key, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= self.clock()):
+                self._data.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value, ex=None):
+        """Sets key to value, expiring after ex seconds"""
+        with self._lock:
+            expires = self.clock() + ex if ex else None
+            self._data[key] = (expires, value)
+
+    def delete(self, *keys):
+        """Removes keys"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def scan_iter(self, match="*"):
+        """Returns the keys that match a glob style pattern"""
+        with self._lock:
+            return [key for key in self._data if fnmatchcase(key, match)]
+
+
+class SharedCache:
+    """A cache kept in a store shared by every worker, such as Redis
+
+    Values are stored as JSON so any process can read them, and an
+    invalidation in one worker is seen by all of the others. Eviction is
+    left to the store, so only hits and misses are counted here.
+    """
+
+    name = "shared"
+
+    def __init__(self, client, ttl=30.0, prefix="orders:cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the value stored under key, or None"""
+        raw = self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value):
+        """Stores value under key until the TTL runs out"""
+        self.client.set(f"{self.prefix}{key}", json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, key):
+        """Removes key from the cache"""
+        self.client.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        """Removes every entry under the prefix"""
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        """Returns the counters of the cache"""
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": None,
+        }
+
+
+def shared_client(url):
+    """Returns a key/value store client for a CACHE_URL"""
+    if url.startswith("memory://"):
+        return InMemoryStore()
+    try:
+        import redis  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise RuntimeError("CACHE_URL needs the redis package") from error
+    return redis.Redis.from_url(url)
+
+
+class OrderCache:
+    """Caches serialized Orders by id
+
+    Like the SQLAlchemy object, it is created at import time and bound to
+    the Flask app later with init_app(). Until then, or when the backend
+    is "none", every call is a cheap no-op.
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        """Creates the backend configured for the app"""
+        kind = app.config.get("CACHE_BACKEND", "lru")
+        ttl = app.config.get("CACHE_TTL", 30.0)
+        if kind == "lru":
+            self.backend = LRUCache(app.config.get("CACHE_MAXSIZE", 1024), ttl)
+        elif kind == "shared":
+            client = shared_client(app.config.get("CACHE_URL", "memory://"))
+            self.backend = SharedCache(client, ttl)
+        elif kind == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+
+    def get(self, order_id):
+        """Returns the cached payload of an Order, or None"""
+        if self.backend is None:
+            return None
+        return self.backend.get(str(order_id))
+
+    def set(self, order_id, payload):
+        """Caches the payload of an Order"""
+        if self.backend is not None:
+            self.backend.set(str(order_id), payload)
+
+    def invalidate(self, order_id):
+        """Drops an Order after it, or one of its Items, was written"""
+        if self.backend is not None and order_id is not None:
+            self.backend.delete(str(order_id))
+
+    def clear(self):
+        """Drops every cached Order"""
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters of the backend"""
+        if self.backend is None:
+            return {"backend": "none"}
+        return self.backend.stats()
+
+
+# The cache of serialized Orders, bound to the app in service/__init__.py
+order_cache = OrderCache()
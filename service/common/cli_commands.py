@@ -1,8 +1,15 @@
 """
 Flask CLI Command Extensions
 """
+import json
+import os
+import time
+from datetime import datetime, timezone
+import click
 from service import app
-from service.models import db
+from service.models import db, Order, Item, IdempotencyKey, create_missing_indexes, rebuild_summaries, upgrade_schema
+from service.common.importing import CSV, NDJSON, import_orders, read_records
+from service.common.seeding import seed_database
 
 
 ######################################################################
@@ -19,3 +26,236 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to upgrade the tables made by an older version in place
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Upgrades a database made by an older version of the service.
+
+    The service adds the missing columns and triggers when it starts; this
+    also builds the missing indexes without blocking writes. Unlike
+    db-create it drops nothing, so it is safe on production.
+    """
+    upgrade_schema()
+    created = create_missing_indexes()
+    click.echo(f"Created {len(created)} index(es)" + "".join(f"\n  {name}" for name in created))
+
+
+######################################################################
+# Command to fill the tables with generated orders for scale testing
+# Usage:
+#   flask db-seed --orders 10000000 --items-per-order 3 [--workers 8]
+######################################################################
+@app.cli.command("db-seed")
+@click.option("--orders", type=click.IntRange(min=1), default=10000, show_default=True)
+@click.option("--items-per-order", type=click.IntRange(min=0), default=3, show_default=True)
+@click.option(
+    "--workers", type=click.IntRange(min=1), default=os.cpu_count() or 1, help="worker processes (default: one per CPU)"
+)
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000, show_default=True, help="orders per transaction")
+@click.option(
+    "--method",
+    type=click.Choice(["copy", "insert"]),
+    default="copy",
+    show_default=True,
+    help="COPY, or batched multi-row INSERTs",
+)
+@click.option("--seed", type=int, default=None, help="random seed, for repeatable data")
+def db_seed(orders, items_per_order, workers, batch_size, method, seed):  # pylint: disable=too-many-arguments
+    """
+    Adds generated orders and items to the database for scale testing.
+
+    The orders are written in batches by parallel worker processes with
+    COPY, and the command reports how many rows per second it wrote.
+    """
+    # The workers are forked, so they must not inherit open connections
+    db.session.remove()
+    db.engine.dispose()
+
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    start = time.perf_counter()
+    written_orders = written_items = 0
+    for batch_orders, batch_items in seed_database(uri, orders, items_per_order, workers, batch_size, method, seed):
+        written_orders += batch_orders
+        written_items += batch_items
+        elapsed = time.perf_counter() - start
+        click.echo(
+            f"{written_orders}/{orders} orders, {written_items} items "
+            f"({(written_orders + written_items) / elapsed:,.0f} rows/s)"
+        )
+
+    elapsed = time.perf_counter() - start
+    rows = written_orders + written_items
+    click.echo(
+        f"Seeded {written_orders} orders and {written_items} items in {elapsed:.1f}s "
+        f"with {workers} worker(s): {rows / elapsed:,.0f} rows/s"
+    )
+
+
+######################################################################
+# Command to load orders from a CSV or NDJSON file
+# Usage:
+#   flask db-import orders.csv [--errors orders.errors.ndjson]
+######################################################################
+@app.cli.command("db-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "media_type",
+    type=click.Choice(["csv", "ndjson"]),
+    default=None,
+    help="file format (default: from the extension)",
+)
+@click.option("--errors", "errors_path", default=None, help="rejected rows file (default: PATH.errors.ndjson)")
+@click.option(
+    "--chunk-size", type=click.IntRange(min=1), default=None, help="orders per transaction (default: IMPORT_CHUNK_SIZE)"
+)
+def db_import(path, media_type, errors_path, chunk_size):
+    """
+    Imports orders and their items from a CSV or NDJSON file.
+
+    Every rejected row is written to the errors file as a JSON line with
+    its line number, the error and the row, and the command reports how
+    many rows per second it wrote.
+    """
+    if media_type is None:
+        media_type = "csv" if path.lower().endswith(".csv") else "ndjson"
+    media_type = CSV if media_type == "csv" else NDJSON
+    errors_path = errors_path or f"{path}.errors.ndjson"
+    chunk_size = chunk_size or app.config["IMPORT_CHUNK_SIZE"]
+
+    start = time.perf_counter()
+    with open(path, encoding="utf-8", newline="") as stream, open(errors_path, "w", encoding="utf-8") as errors:
+
+        def rejected(line_number, error, data):
+            errors.write(json.dumps({"line": line_number, "error": error, "record": data}, default=str) + "\n")
+
+        totals = import_orders(read_records(stream, media_type), chunk_size, rejected)
+
+    elapsed = time.perf_counter() - start
+    rows = totals["imported"] + totals["items"]
+    click.echo(
+        f"Imported {totals['imported']} orders and {totals['items']} items in {elapsed:.1f}s: "
+        f"{rows / elapsed:,.0f} rows/s"
+    )
+    if totals["rejected"]:
+        click.echo(f"Rejected {totals['rejected']} row(s), see {errors_path}")
+
+
+######################################################################
+# Command to recompute the order summary tables, e.g. after a backfill
+# Usage:
+#   flask summary-rebuild
+######################################################################
+@app.cli.command("summary-rebuild")
+def summary_rebuild():
+    """
+    Recomputes the order summaries behind GET /orders/stats.
+
+    Triggers keep them up to date with every write, so this is only needed
+    for orders written while the triggers were missing. Order writes wait
+    until it is done.
+    """
+    start = time.perf_counter()
+    days, users = rebuild_summaries()
+    click.echo(f"Rebuilt {days} daily and {users} user summary row(s) in {time.perf_counter() - start:.1f}s")
+
+
+######################################################################
+# Command to delete expired idempotency keys, e.g. from cron
+# Usage:
+#   flask idempotency-purge
+######################################################################
+@app.cli.command("idempotency-purge")
+def idempotency_purge():
+    """Deletes the stored responses of Idempotency-Keys that have expired"""
+    count = IdempotencyKey.purge_expired()
+    click.echo(f"Deleted {count} expired idempotency key(s)")
+
+
+######################################################################
+# Command to check the query plans of the standard filters
+# Usage:
+#   flask db-explain [--allow-seqscan]
+######################################################################
+def query_shapes():
+    """Returns the (description, query) pairs the service runs most often"""
+    page = app.config["DEFAULT_PAGE_SIZE"]
+    after = (datetime.now(timezone.utc), 0)
+    return [
+        ("orders page", Order.keyset_query(Order.query, page, after)),
+        ("orders by id", Order.query.filter(Order.id == 0)),
+        (
+            "orders by user_id (recent first)",
+            Order.keyset_query(Order.query.filter(Order.user_id == 0), page),
+        ),
+        ("orders by status", Order.query.filter(Order.status == "NEW")),
+        ("orders by name", Order.query.filter(Order.name == "")),
+        (
+            "orders created in a range",
+            Order.keyset_query(Order.query.filter(Order.create_time >= after[0], Order.create_time < after[0]), page),
+        ),
+        ("order stats by status", Order.stats_query(Order.query, ("status",))),
+        (
+            "order stats by day in a range",
+            Order.stats_query(Order.query.filter(Order.create_time >= after[0]), ("day",)),
+        ),
+        ("order stats of a user", Order.stats_query(Order.query.filter(Order.user_id == 0))),
+        ("items by order_id", Item.query.filter(Item.order_id == 0)),
+        (
+            "item by order_id and id",
+            Item.query.filter(Item.order_id == 0, Item.id == 0),
+        ),
+    ]
+
+
+def seq_scans(plan):
+    """Yields the relation names of every Seq Scan node in a JSON plan"""
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+@app.cli.command("db-explain")
+@click.option(
+    "--allow-seqscan",
+    is_flag=True,
+    help="Let the planner pick sequential scans (small tables always will).",
+)
+def db_explain(allow_seqscan):
+    """
+    Runs EXPLAIN on the standard order filters and flags sequential scans.
+
+    By default sequential scans are disabled for the check, so the planner
+    picks an index whenever one exists and a Seq Scan means a missing index.
+    """
+    connection = db.session.connection()
+    if not allow_seqscan:
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+    flagged = 0
+    for description, query in query_shapes():
+        compiled = query.statement.compile(dialect=connection.dialect)
+        result = connection.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + compiled.string, compiled.params
+        )
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        tables = sorted(set(seq_scans(plan[0]["Plan"])))
+        if tables:
+            flagged += 1
+            click.echo(f"SEQ SCAN  {description}: {', '.join(tables)}")
+        else:
+            click.echo(f"ok        {description}")
+    db.session.rollback()
+
+    if flagged:
+        raise click.ClickException(f"{flagged} query shape(s) use a sequential scan")
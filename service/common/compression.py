@@ -0,0 +1,237 @@
+"""
+Response Compression
+
+This module compresses responses with the best content coding the client
+accepts: zstd and br when the zstandard and brotli packages are installed,
+and gzip always. Bodies smaller than COMPRESS_MIN_SIZE are sent as they
+are, since compressing them saves less than it costs. Streamed responses
+are compressed chunk by chunk as they are sent, each chunk flushed so the
+client can decode it right away.
+
+A compressed response is a different representation, so its ETag gets the
+coding as a suffix ("2" becomes "2-gzip"); etag_matches() lets conditional
+requests name any of them.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Media types worth compressing, besides text/*
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson", "application/msgpack", "application/xml"}
+
+# Every content coding a response may be sent with
+CODINGS = ("zstd", "br", "gzip")
+
+
+class StreamCompressor:
+    """A zlib or zstandard compressor with compress(data), sync() and flush()"""
+
+    def __init__(self, compressobj, sync_mode):
+        self.compressobj = compressobj
+        self.sync_mode = sync_mode
+
+    def compress(self, data):
+        """Compresses a chunk of data"""
+        return self.compressobj.compress(data)
+
+    def sync(self):
+        """Returns everything compressed so far, without ending the stream"""
+        return self.compressobj.flush(self.sync_mode)
+
+    def flush(self):
+        """Finishes the stream"""
+        return self.compressobj.flush()
+
+
+class GzipCodec:
+    """gzip with zlib"""
+
+    name = "gzip"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressobj(self):
+        """Returns a new compressor with compress(data), sync() and flush()"""
+        return StreamCompressor(
+            zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS | 16), zlib.Z_SYNC_FLUSH
+        )
+
+
+class BrotliCodec:
+    """br with the brotli package"""
+
+    name = "br"
+
+    def __init__(self, quality=4):
+        self.quality = quality
+
+    def compressobj(self):
+        """Returns a new compressor with compress(data), sync() and flush()"""
+        return BrotliCompressor(brotli.Compressor(quality=self.quality))
+
+
+class BrotliCompressor:
+    """Gives a brotli Compressor the interface of a zlib compressor"""
+
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, data):
+        """Compresses a chunk of data"""
+        return self.compressor.process(data)
+
+    def sync(self):
+        """Returns everything compressed so far, without ending the stream"""
+        return self.compressor.flush()
+
+    def flush(self):
+        """Finishes the stream"""
+        return self.compressor.finish()
+
+
+class ZstdCodec:
+    """zstd with the zstandard package"""
+
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compressobj(self):
+        """Returns a new compressor with compress(data), sync() and flush()"""
+        return StreamCompressor(
+            zstandard.ZstdCompressor(level=self.level).compressobj(), zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+
+def available_codecs(names, level):
+    """Returns the codecs for a list of encoding names, in order of
+    preference, leaving out those whose package is not installed
+    """
+    codecs = []
+    for name in names:
+        if name == "zstd" and zstandard is not None:
+            codecs.append(ZstdCodec())
+        elif name == "br" and brotli is not None:
+            codecs.append(BrotliCodec())
+        elif name == "gzip":
+            codecs.append(GzipCodec(level))
+        elif name not in ("zstd", "br"):
+            raise ValueError(f"Unknown content coding: {name}")
+    return codecs
+
+
+def compress_stream(chunks, compressobj):
+    """Compresses an iterable of chunks as they come
+
+    Each chunk is flushed on its own, so the streams should send batches
+    rather than single rows.
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressobj.compress(chunk) + compressobj.sync()
+            if data:
+                yield data
+        yield compressobj.flush()
+    finally:
+        # Let a stream_with_context() generator tear down its request context
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def etag_matches(etags, tag, weak=False):
+    """Tells if If-Match or If-None-Match ETags name a tag, in any coding
+
+    Args:
+        etags (ETags): the ETags of the request header
+        tag (string): the ETag of the uncompressed response
+        weak (bool): compare weakly, as If-None-Match does
+    """
+    contains = etags.contains_weak if weak else etags.contains
+    return any(contains(variant) for variant in [tag] + [f"{tag}-{name}" for name in CODINGS])
+
+
+def is_compressible(response):
+    """Tells if the media type of a response is worth compressing"""
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+class Compressor:
+    """Compresses the responses of an app
+
+    Like the Order cache, it is created at import time and bound to the
+    Flask app later with init_app().
+    """
+
+    def __init__(self):
+        self.codecs = {}
+        self.min_size = 1024
+
+    def init_app(self, app):
+        """Loads the codecs configured for the app and compresses its responses"""
+        names = [name.strip() for name in app.config.get("COMPRESS_ENCODINGS", "gzip").split(",")]
+        codecs = available_codecs([name for name in names if name], app.config.get("COMPRESS_LEVEL", 6))
+        self.codecs = {codec.name: codec for codec in codecs}
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        """Compresses a response with the best coding the client accepts"""
+        if not self.codecs or not is_compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.status_code == 304:
+            return self.not_modified(response)
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206)
+            or "Content-Encoding" in response.headers
+            or response.direct_passthrough
+        ):
+            return response
+        name = request.accept_encodings.best_match(list(self.codecs))
+        if name is None:
+            return response
+
+        codec = self.codecs[name]
+        if response.is_streamed:
+            response.response = compress_stream(response.response, codec.compressobj())
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressobj = codec.compressobj()
+            response.set_data(compressobj.compress(data) + compressobj.flush())
+        response.headers["Content-Encoding"] = name
+        tag, weak = response.get_etag()
+        if tag:
+            response.set_etag(f"{tag}-{name}", weak)
+        return response
+
+    def not_modified(self, response):
+        """Gives a 304 the ETag of the coding the client has, if it named one"""
+        tag, weak = response.get_etag()
+        if tag:
+            for name in self.codecs:
+                if request.if_none_match.contains_weak(f"{tag}-{name}"):
+                    response.set_etag(f"{tag}-{name}", weak)
+                    break
+        return response
+
+
+# The response compressor, bound to the app in service/__init__.py
+compressor = Compressor()
@@ -0,0 +1,110 @@
+"""
+JSON Encoders
+
+This module contains the encoders used to write large JSON responses.
+Both produce exactly the bytes of Flask's jsonify() outside debug mode:
+sorted keys, no whitespace, and ASCII only. The encoder is chosen with
+JSON_ENCODER:
+
+    auto    - orjson when it is installed, else the standard library (default)
+    orjson  - orjson, which must be installed
+    stdlib  - the standard library json module
+"""
+import json
+import re
+from flask import current_app, jsonify, make_response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Output that orjson writes differently from json.dumps(): floats with an
+# exponent ("1e16" vs "1e+16") and below 1e-4 ("0.00001" vs "1e-05").
+# Matches inside strings only cost a needless fallback.
+EXPONENT = re.compile(rb"e[-+]?[0-9]")
+SMALL_FLOAT = b"0.0000"
+
+
+class StdlibEncoder:
+    """Encodes with the standard library, like Flask's default JSON provider"""
+
+    name = "stdlib"
+
+    def dumps(self, obj):
+        """Returns obj as compact JSON bytes"""
+        return json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(",", ":")).encode("ascii")
+
+
+class OrjsonEncoder:
+    """Encodes with orjson, falling back to the standard library when the
+    result would not be byte for byte the same
+
+    orjson writes non-ASCII characters as UTF-8 and some floats in another
+    notation, so those payloads, which are rare, are encoded again with the
+    standard library. It also writes NaN and infinities as null, but
+    deserialize() keeps them out of the Orders and Items.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("JSON_ENCODER=orjson needs the orjson package")
+        self.fallback = StdlibEncoder()
+
+    def dumps(self, obj):
+        """Returns obj as compact JSON bytes"""
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return self.fallback.dumps(obj)
+        if not data.isascii() or SMALL_FLOAT in data or EXPONENT.search(data):
+            return self.fallback.dumps(obj)
+        return data
+
+
+def load_encoder(name):
+    """Returns the encoder for a JSON_ENCODER setting"""
+    if name == "auto":
+        name = "stdlib" if orjson is None else "orjson"
+    if name == "orjson":
+        return OrjsonEncoder()
+    if name == "stdlib":
+        return StdlibEncoder()
+    raise ValueError(f"Unknown JSON_ENCODER: {name}")
+
+
+class FastJSON:
+    """Writes JSON responses with the configured encoder
+
+    Like the Order cache, it is created at import time and bound to the
+    Flask app later with init_app().
+    """
+
+    def __init__(self):
+        self.encoder = StdlibEncoder()
+
+    def init_app(self, app):
+        """Loads the encoder configured for the app"""
+        self.encoder = load_encoder(app.config.get("JSON_ENCODER", "auto"))
+
+    def dumps(self, obj):
+        """Returns obj as compact JSON bytes"""
+        return self.encoder.dumps(obj)
+
+    def response(self, obj, status, headers=None):
+        """Returns a response with the same body jsonify(obj) would have"""
+        if current_app.debug:
+            # jsonify() pretty prints in debug mode
+            return make_response(jsonify(obj), status, headers)
+        return current_app.response_class(
+            self.encoder.dumps(obj) + b"\n",
+            status=status,
+            headers=headers,
+            mimetype="application/json",
+        )
+
+
+# The JSON writer of the list endpoints, bound to the app in service/__init__.py
+fast_json = FastJSON()
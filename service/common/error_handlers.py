@@ -17,12 +17,22 @@
 """
 Module: error_handlers
 """
-from flask import jsonify
-from service.models import DataValidationError
+from flask import request
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, OrderNotFoundError, db
 from service import app
+from service.common.serializers import serializers
 from . import status
 
 
+def error_response(code, error, message):
+    """Returns an error body in the registered media type the client prefers"""
+    serializer = serializers.negotiate(request.accept_mimetypes)
+    response = serializer.response({"status": code, "error": error, "message": message}, code)
+    response.vary.add("Accept")
+    return response
+
+
 ######################################################################
 # Error Handlers
 ######################################################################
@@ -32,17 +42,18 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@app.errorhandler(OrderNotFoundError)
+def order_not_found(error):
+    """Handles writes to missing Orders"""
+    return not_found(error)
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(
-            status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
-        ),
-        status.HTTP_400_BAD_REQUEST,
-    )
+    return error_response(status.HTTP_400_BAD_REQUEST, "Bad Request", message)
 
 
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
@@ -50,10 +61,7 @@ def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(status=status.HTTP_404_NOT_FOUND, error="Not Found", message=message),
-        status.HTTP_404_NOT_FOUND,
-    )
+    return error_response(status.HTTP_404_NOT_FOUND, "Not Found", message)
 
 
 @app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -61,14 +69,7 @@ def method_not_supported(error):
     """Handles unsupported HTTP methods with 405_METHOD_NOT_SUPPORTED"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(
-            status=status.HTTP_405_METHOD_NOT_ALLOWED,
-            error="Method not Allowed",
-            message=message,
-        ),
-        status.HTTP_405_METHOD_NOT_ALLOWED,
-    )
+    return error_response(status.HTTP_405_METHOD_NOT_ALLOWED, "Method not Allowed", message)
 
 
 @app.errorhandler(status.HTTP_409_CONFLICT)
@@ -76,14 +77,22 @@ def resource_conflict(error):
     """Handles resource conflicts with HTTP_409_CONFLICT"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(
-            status=status.HTTP_409_CONFLICT,
-            error="Conflict",
-            message=message,
-        ),
-        status.HTTP_409_CONFLICT,
-    )
+    return error_response(status.HTTP_409_CONFLICT, "Conflict", message)
+
+
+@app.errorhandler(StaleDataError)
+def stale_data(error):
+    """Handles an Order that changed under a conditional update"""
+    db.session.rollback()
+    return precondition_failed(error)
+
+
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed If-Match preconditions with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return error_response(status.HTTP_412_PRECONDITION_FAILED, "Precondition Failed", message)
 
 
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
@@ -91,14 +100,7 @@ def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
     message = str(error)
     app.logger.warning(message)
-    return (
-        jsonify(
-            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            error="Unsupported media type",
-            message=message,
-        ),
-        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-    )
+    return error_response(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Unsupported media type", message)
 
 
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -106,11 +108,4 @@ def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
     message = str(error)
     app.logger.error(message)
-    return (
-        jsonify(
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            error="Internal Server Error",
-            message=message,
-        ),
-        status.HTTP_500_INTERNAL_SERVER_ERROR,
-    )
+    return error_response(status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal Server Error", message)
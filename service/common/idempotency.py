@@ -0,0 +1,66 @@
+"""
+Idempotency Keys
+
+A client that retries POST /orders after a timeout sends the same
+Idempotency-Key header again. The first request stores its response
+(status, Location and body) in the idempotency_key table, in the same
+transaction as the new Order, and every retry gets that response back
+instead of creating another Order.
+
+This module keeps the recently stored responses in a small in-process
+cache, so most retries are answered without a database round trip, and
+fingerprints requests so a key cannot be reused for a different one.
+Keys are kept for IDEMPOTENCY_TTL seconds.
+"""
+import hashlib
+import time
+from service.common.cache import LRUCache
+
+
+def request_fingerprint(request):
+    """Returns a digest of the method, path, media type and body of a request"""
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, request.mimetype):
+        digest.update(part.encode("utf-8") + b"\0")
+    digest.update(request.get_data())
+    return digest.digest()
+
+
+class ResponseCache:
+    """Caches the stored responses of Idempotency-Keys in this process
+
+    Like the Order cache, it is created at import time and bound to the
+    Flask app later with init_app(). A stored response never changes, so
+    there is nothing to invalidate: entries only expire with their key.
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        """Creates the cache with the size and TTL configured for the app"""
+        ttl = app.config.get("IDEMPOTENCY_TTL", 86400)
+        self.backend = LRUCache(app.config.get("IDEMPOTENCY_CACHE_SIZE", 1024), ttl)
+
+    def get(self, key):
+        """Returns the stored response of a key, or None"""
+        if self.backend is None:
+            return None
+        entry = self.backend.get(key)
+        if entry is None or entry["expires"] <= time.time():
+            return None
+        return entry
+
+    def set(self, key, entry):
+        """Caches the stored response of a key"""
+        if self.backend is not None:
+            self.backend.set(key, entry)
+
+    def clear(self):
+        """Drops every cached response"""
+        if self.backend is not None:
+            self.backend.clear()
+
+
+# The hot cache of stored responses, bound to the app in service/__init__.py
+idempotency_cache = ResponseCache()
@@ -0,0 +1,223 @@
+"""
+Order Import
+
+This module loads Orders from a CSV or NDJSON stream without going
+through POST /orders one Order at a time (see flask db-import and
+POST /orders/import).
+
+NDJSON has one Order per line, in the body of POST /orders. CSV has a
+header row with the Order fields and an optional "items" column holding
+a JSON array of Items.
+
+Rows are read and checked chunk by chunk with Order.deserialize() and
+Item.deserialize(), and against the types and lengths of the columns, so
+a bad row is reported with its line number and never fails a COPY. Each
+chunk is copied into temporary staging tables with COPY FROM STDIN and
+merged into the order and item tables with one INSERT ... SELECT each,
+in its own transaction.
+"""
+import csv
+import json
+from sqlalchemy import BigInteger, DateTime, Enum, Float, Integer, SmallInteger, text
+from service.models import ALLOCATE_ORDER_IDS, ITEM_COLUMNS, ORDER_COLUMNS, DataValidationError, Item, Order, db
+from service.common.bulk import chunked, copy_rows, read_ndjson
+
+CSV = "text/csv"
+NDJSON = "application/x-ndjson"
+
+
+# The largest magnitude of each integer column type (int2, int8, int4)
+INTEGER_BITS = ((SmallInteger, 15), (BigInteger, 63), (Integer, 31))
+
+# Staging tables with the column types of the real ones and no constraints
+STAGING_TABLES = (
+    f'CREATE TEMP TABLE order_import ON COMMIT DROP AS SELECT {", ".join(ORDER_COLUMNS)} FROM "order" WITH NO DATA',
+    f'CREATE TEMP TABLE item_import ON COMMIT DROP AS SELECT {", ".join(ITEM_COLUMNS)} FROM item WITH NO DATA',
+)
+MERGES = (
+    f'INSERT INTO "order" ({", ".join(ORDER_COLUMNS)}) SELECT {", ".join(ORDER_COLUMNS)} FROM order_import',
+    f'INSERT INTO item ({", ".join(ITEM_COLUMNS)}) SELECT {", ".join(ITEM_COLUMNS)} FROM item_import',
+)
+
+
+def read_csv(stream):
+    """Yields (line number, Order data) pairs from a CSV text stream
+
+    The line number is where the row starts, the header being line 1. A
+    row whose items are not valid JSON yields a ValueError instead.
+    """
+    reader = csv.DictReader(stream)
+    line_number = 2
+    for row in reader:
+        data = dict(row)
+        try:
+            data["items"] = json.loads(data.get("items") or "[]")
+        except ValueError as error:
+            data = ValueError(f"Invalid items: {error}")
+        yield line_number, data
+        line_number = reader.line_num + 1
+
+
+def read_records(stream, media_type):
+    """Yields the (line number, Order data) pairs of a CSV or NDJSON text stream"""
+    if media_type == CSV:
+        return read_csv(stream)
+    if media_type == NDJSON:
+        return read_ndjson(stream)
+    raise ValueError(f"Cannot import {media_type}, only {CSV} or {NDJSON}")
+
+
+def check_integer(column_type, value):
+    """Returns a value as an int in the range of an integer column type
+
+    Raises:
+        ValueError: if it is not an integer or is out of range
+    """
+    number = value if isinstance(value, int) else int(str(value).strip())
+    bits = next(bits for type_, bits in INTEGER_BITS if isinstance(column_type, type_))
+    if not -(2**bits) <= number < 2**bits:
+        raise ValueError(f"{number} is out of range")
+    return number
+
+
+def check_column(kind, column, value):
+    """Returns a value converted to the type of its column
+
+    Anything COPY would refuse is caught here: values of the wrong type,
+    integers out of the column's range, NUL characters and strings longer
+    than the column.
+
+    Raises:
+        DataValidationError: if the value does not fit the column
+    """
+    if value is None:
+        if not column.nullable:
+            raise DataValidationError(f"Invalid {kind}: missing {column.name}")
+        return None
+    if isinstance(column.type, (Enum, DateTime)):
+        return value  # already checked by deserialize()
+    try:
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"not a {column.type.python_type.__name__}")
+        if isinstance(column.type, Integer):
+            return check_integer(column.type, value)
+        if isinstance(column.type, Float):
+            return float(value)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid {kind}: bad {column.name} {value!r}") from error
+    return check_string(kind, column, str(value))
+
+
+def check_string(kind, column, value):
+    """Returns a string that fits a text column
+
+    Raises:
+        DataValidationError: if it has a NUL character or is too long
+    """
+    if "\x00" in value:
+        raise DataValidationError(f"Invalid {kind}: {column.name} contains a NUL character")
+    if column.type.length and len(value) > column.type.length:
+        raise DataValidationError(f"Invalid {kind}: {column.name} is longer than {column.type.length}")
+    return value
+
+
+def check_values(kind, table, values, names):
+    """Returns the values of some columns of a table, checked by check_column()"""
+    return [check_column(kind, table.c[name], values[name]) for name in names]
+
+
+def validate(data):
+    """Returns the (order row, item rows) of an imported Order, without ids
+
+    Raises:
+        DataValidationError: if the Order is rejected
+    """
+    return check_order(Order().deserialize(data))
+
+
+def check_order(order):
+    """Returns the (order row, item rows) of a deserialized Order, without ids
+
+    POST /orders/bulk runs this too, so a row the database would refuse is
+    reported as a 400 instead of failing its whole chunk.
+
+    Raises:
+        DataValidationError: if a value does not fit its column
+    """
+    values = order.values()
+    values.update(create_time=order.create_time.isoformat(), status=order.status.name)
+    row = check_values("Order", Order.__table__, values, ORDER_COLUMNS[1:])
+    return row, [check_item(item) for item in order.items]
+
+
+def check_item(item):
+    """Returns the item row of a deserialized Item, without its order_id
+
+    POST /orders/<order_id>/items/bulk runs this too.
+
+    Raises:
+        DataValidationError: if a value does not fit its column
+    """
+    values = item.values()
+    values["status"] = item.status.name
+    return check_values("Item", Item.__table__, values, ITEM_COLUMNS[1:])
+
+
+def merge_chunk(rows):
+    """Copies the validated rows of a chunk into staging tables and merges them
+
+    Args:
+        rows (list): (order row, item rows) pairs from validate()
+
+    Returns:
+        the (orders, items) written
+    """
+    ids = db.session.execute(ALLOCATE_ORDER_IDS, {"count": len(rows)}).scalars().all()
+    orders = []
+    items = []
+    for order_id, (order, order_items) in zip(ids, rows):
+        orders.append([order_id] + order)
+        items.extend([order_id] + item for item in order_items)
+
+    connection = db.session.connection()
+    for statement in STAGING_TABLES:
+        connection.execute(text(statement))
+    cursor = connection.connection.cursor()
+    copy_rows(cursor, "order_import", ORDER_COLUMNS, orders)
+    copy_rows(cursor, "item_import", ITEM_COLUMNS, items)
+    cursor.close()
+    for statement in MERGES:
+        connection.execute(text(statement))
+    db.session.commit()
+    return len(orders), len(items)
+
+
+def import_orders(records, chunk_size, on_error):
+    """Imports Orders from (line number, data) pairs a chunk at a time
+
+    Args:
+        records (iterable): pairs from read_records()
+        chunk_size (int): the number of Orders checked and written at once
+        on_error (function): called with (line number, error, data) for
+            every rejected row
+
+    Returns:
+        a dictionary with the number of Orders and Items imported and
+        of rows rejected
+    """
+    totals = {"imported": 0, "items": 0, "rejected": 0}
+    for chunk in chunked(records, chunk_size):
+        rows = []
+        for line_number, data in chunk:
+            try:
+                if isinstance(data, ValueError):
+                    raise DataValidationError(str(data))
+                rows.append(validate(data))
+            except DataValidationError as error:
+                totals["rejected"] += 1
+                on_error(line_number, str(error), None if isinstance(data, ValueError) else data)
+        if rows:
+            orders, items = merge_chunk(rows)
+            totals["imported"] += orders
+            totals["items"] += items
+    return totals
@@ -0,0 +1,151 @@
+"""
+Metrics
+
+This module collects Prometheus metrics for every request: a count, a
+latency histogram and an in-flight gauge per route and status code, the
+time spent waiting for a connection from the database pool, in all and
+per request, and the SQL time of each request. They are served as text by
+GET /metrics. The pool wait of a request is also sent back as a "pool"
+entry of its Server-Timing header.
+
+Under gunicorn every worker has its own counters. Point the
+PROMETHEUS_MULTIPROC_DIR environment variable at an empty directory that
+all workers share and each worker writes its values to a memory mapped
+file there, which /metrics adds up at scrape time (see gunicorn.conf.py).
+"""
+import os
+import time
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from service.common import sql_stats
+
+# Sub-millisecond buckets for waits that are usually close to zero
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = CollectorRegistry()
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by method, route and status code",
+    ["method", "route", "status"],
+    registry=REGISTRY,
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce the HTTP response by method, route and status code",
+    ["method", "route", "status"],
+    registry=REGISTRY,
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being handled by method and route",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the database pool",
+    buckets=WAIT_BUCKETS,
+    registry=REGISTRY,
+)
+POOL_REQUEST_WAIT = Histogram(
+    "db_request_pool_wait_seconds",
+    "Time spent waiting for database pool connections per HTTP request by route",
+    ["route"],
+    buckets=WAIT_BUCKETS,
+    registry=REGISTRY,
+)
+SQL_STATEMENTS = Histogram(
+    "db_request_statements",
+    "Number of SQL statements per HTTP request by route",
+    ["route"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200),
+    registry=REGISTRY,
+)
+SQL_TIME = Histogram(
+    "db_request_sql_seconds",
+    "Total time spent running SQL statements per HTTP request by route",
+    ["route"],
+    buckets=WAIT_BUCKETS,
+    registry=REGISTRY,
+)
+
+
+def route_label():
+    """Returns the URL rule of the request, so ids don't explode the labels"""
+    return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+
+def instrument_pool(pool):
+    """Times every checkout from a connection pool
+
+    Calling it again on the same pool is a no-op, so it is cheap to call
+    on every request and also covers pools recreated by Engine.dispose().
+    """
+    if getattr(pool, "checkout_timed", False):
+        return
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            elapsed = time.perf_counter() - start
+            POOL_WAIT.observe(elapsed)
+            if has_request_context():
+                g.pool_wait_seconds = g.get("pool_wait_seconds", 0.0) + elapsed
+
+    pool.connect = timed_connect
+    pool.checkout_timed = True
+
+
+def render():
+    """Returns the (body, content type) of the metrics exposition"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app, db):
+    """Records the metrics of every request the app handles"""
+    @app.before_request
+    def start_request():
+        g.pool_wait_seconds = 0.0
+        g.request_start = time.perf_counter()
+        g.metrics_route = route_label()
+        IN_FLIGHT.labels(request.method, g.metrics_route).inc()
+        instrument_pool(db.engine.pool)
+
+    @app.after_request
+    def record_request(response):
+        if "request_start" in g:
+            elapsed = time.perf_counter() - g.pop("request_start")
+            labels = (request.method, g.metrics_route, str(response.status_code))
+            REQUESTS.labels(*labels).inc()
+            LATENCY.labels(*labels).observe(elapsed)
+            count, seconds = sql_stats.request_totals()
+            SQL_STATEMENTS.labels(g.metrics_route).observe(count)
+            SQL_TIME.labels(g.metrics_route).observe(seconds)
+            wait = g.get("pool_wait_seconds", 0.0)
+            POOL_REQUEST_WAIT.labels(g.metrics_route).observe(wait)
+            response.headers.add("Server-Timing", f"pool;dur={wait * 1000:.3f}")
+        return response
+
+    @app.teardown_request
+    def finish_request(error):  # pylint: disable=unused-argument
+        route = g.pop("metrics_route", None)
+        if route is not None:
+            IN_FLIGHT.labels(request.method, route).dec()
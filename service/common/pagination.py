@@ -0,0 +1,60 @@
+"""
+Pagination helpers
+
+This module contains utility functions for keyset (cursor) pagination.
+A cursor is an opaque, URL safe token that encodes the sort key of the
+last row on a page, so the next page can be found with an index seek
+instead of an OFFSET scan.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+
+class InvalidCursorError(Exception):
+    """Used when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(create_time, row_id):
+    """Encodes the (create_time, id) position of a row into a cursor"""
+    position = [create_time.isoformat(), row_id]
+    token = base64.urlsafe_b64encode(json.dumps(position).encode("utf-8"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor back into a (create_time, id) tuple
+
+    Args:
+        cursor (string): a token previously returned by encode_cursor()
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        create_time, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(row_id, int):
+            raise TypeError("id must be an integer")
+        return datetime.fromisoformat(create_time), row_id
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as error:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from error
+
+
+def parse_limit(value, default, maximum):
+    """Returns the page size requested by a client, capped at the maximum
+
+    Args:
+        value (string): the raw "limit" query parameter or None
+        default (int): the page size to use when no limit is given
+        maximum (int): the largest page size the server will return
+    """
+    if value is None:
+        return default
+    limit = int(value)  # raises ValueError on junk
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, maximum)
+
+
+def link_header(url, rel):
+    """Formats a single RFC 8288 Link header value"""
+    return f'<{url}>; rel="{rel}"'
@@ -0,0 +1,57 @@
+"""
+Connection Pooling
+
+This module turns the DB_* settings into the SQLAlchemy engine options
+for each worker's connection pool, and reports the state of the pool.
+
+With DB_POOLER_MODE on, the service sits behind an external pooler such
+as PgBouncer in transaction mode. The pooler owns the connections, so
+the workers use a NullPool, and server-side prepared statements are
+turned off because the next transaction may run on another connection.
+"""
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+
+def engine_options(config):
+    """Returns the SQLALCHEMY_ENGINE_OPTIONS for the DB_* settings of an app"""
+    connect_args = {}
+    if config["DB_STATEMENT_TIMEOUT_MS"]:
+        connect_args["options"] = f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"
+
+    if config["DB_POOLER_MODE"]:
+        options = {"poolclass": NullPool}
+        # psycopg2 never prepares statements, psycopg 3 does after 5 runs
+        if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_driver_name() == "psycopg":
+            connect_args["prepare_threshold"] = None
+    else:
+        options = {
+            "pool_size": config["DB_POOL_SIZE"],
+            "max_overflow": config["DB_MAX_OVERFLOW"],
+            "pool_timeout": config["DB_POOL_TIMEOUT"],
+            "pool_recycle": config["DB_POOL_RECYCLE"],
+            "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        }
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def pool_stats(engine, config):
+    """Returns the settings of an engine's pool and how many connections it uses"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "pooler_mode": config["DB_POOLER_MODE"]}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            {
+                "size": pool.size(),
+                "max_overflow": config["DB_MAX_OVERFLOW"],
+                "timeout": pool.timeout(),
+                "recycle": config["DB_POOL_RECYCLE"],
+                "pre_ping": config["DB_POOL_PRE_PING"],
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        )
+    return stats
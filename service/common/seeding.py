@@ -0,0 +1,138 @@
+"""
+Synthetic Data
+
+This module fills the database with generated Orders and Items for scale
+testing (see flask db-seed). The values follow the distributions of
+tests/factories.py: create times spread evenly since 2008, costs and
+prices between 1 and 1000, every status equally likely, user ids between
+1000 and 9999, without needing Faker at run time.
+
+The rows are written in batches by worker processes, each with its own
+connection. A batch reserves its Order ids from the sequence up front,
+then writes the Orders and their Items with one COPY each (or batched
+multi-row INSERTs with method="insert") and commits.
+"""
+import multiprocessing
+import random
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, insert
+from sqlalchemy.pool import NullPool
+from service.models import ALLOCATE_ORDER_IDS, ITEM_COLUMNS, ORDER_COLUMNS, Item, ItemStatus, Order, OrderStatus
+from service.common.bulk import copy_rows
+
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+    "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Thomas", "Moore",
+)
+STREETS = ("Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park")
+CITIES = (
+    ("New York", "NY"), ("Hessmouth", "WI"), ("Williamfort", "KY"), ("Austin", "TX"),
+    ("Portland", "OR"), ("Denver", "CO"), ("Columbus", "OH"), ("Raleigh", "NC"),
+)
+# The same titles as ItemFactory
+TITLES = ("iPhone15", "MacBook Pro", "iPad Pro", "Mac Pro", "iPhone15 Pro", "MacBook Air")
+
+START = datetime(2008, 1, 1, tzinfo=timezone.utc).timestamp()
+
+# The engine of a worker process, created by its first batch
+ENGINE = None
+
+
+def generate_rows(rng, order_ids, items_per_order, end):
+    """Returns the (order rows, item rows) of one batch as tuples of columns"""
+    order_statuses = [status.name for status in OrderStatus]
+    item_statuses = [status.name for status in ItemStatus]
+    orders = []
+    items = []
+    for order_id in order_ids:
+        city, state = rng.choice(CITIES)
+        orders.append(
+            (
+                order_id,
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                datetime.fromtimestamp(rng.uniform(START, end), timezone.utc).isoformat(),
+                f"{rng.randint(1, 9999)} {rng.choice(STREETS)} Street\n"
+                f"{city}, {state} {rng.randint(10000, 99999)}",
+                round(rng.uniform(1.0, 1000.0), 2),
+                rng.choice(order_statuses),
+                rng.randint(1000, 9999),
+            )
+        )
+        for _ in range(items_per_order):
+            items.append(
+                (
+                    order_id,
+                    rng.choice(TITLES),
+                    rng.randint(1, 10),
+                    round(rng.uniform(1.0, 1000.0), 2),
+                    str(rng.randint(1000, 5000)),
+                    rng.choice(item_statuses),
+                )
+            )
+    return orders, items
+
+
+def write_batch(connection, orders, items, method):
+    """Writes the rows of one batch on a connection, without committing"""
+    if method == "copy":
+        cursor = connection.connection.cursor()
+        copy_rows(cursor, Order.__tablename__, ORDER_COLUMNS, orders)
+        copy_rows(cursor, Item.__tablename__, ITEM_COLUMNS, items)
+        cursor.close()
+    else:
+        # executemany, which the driver sends as multi-row INSERTs
+        connection.execute(insert(Order.__table__), [dict(zip(ORDER_COLUMNS, row)) for row in orders])
+        if items:
+            connection.execute(insert(Item.__table__), [dict(zip(ITEM_COLUMNS, row)) for row in items])
+
+
+def seed_batch(task):
+    """Generates and writes one batch in a worker process
+
+    Args:
+        task (tuple): (database_uri, orders, items_per_order, method, random seed)
+
+    Returns:
+        the (orders, items) written
+    """
+    global ENGINE  # pylint: disable=global-statement
+    database_uri, count, items_per_order, method, seed = task
+    if ENGINE is None:
+        ENGINE = create_engine(database_uri, poolclass=NullPool)
+    rng = random.Random(seed)
+    with ENGINE.begin() as connection:
+        order_ids = connection.execute(ALLOCATE_ORDER_IDS, {"count": count}).scalars().all()
+        end = datetime.now(timezone.utc).timestamp()
+        orders, items = generate_rows(rng, order_ids, items_per_order, end)
+        write_batch(connection, orders, items, method)
+    return len(orders), len(items)
+
+
+def batches(database_uri, orders, items_per_order, batch_size, method, seed):
+    """Yields the tasks of seed_batch() for orders Orders"""
+    rng = random.Random(seed)
+    for start in range(0, orders, batch_size):
+        count = min(batch_size, orders - start)
+        yield database_uri, count, items_per_order, method, rng.getrandbits(64)
+
+
+def seed_database(database_uri, orders, items_per_order, workers=1, batch_size=10000, method="copy", seed=None):
+    """Writes generated Orders and Items with worker processes
+
+    The caller must not hold connections it wants to keep using: worker
+    processes are forked and must not share them.
+
+    Yields:
+        the (orders, items) of each batch as it is committed
+    """
+    tasks = batches(database_uri, orders, items_per_order, batch_size, method, seed)
+    if workers <= 1:
+        for task in tasks:
+            yield seed_batch(task)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(seed_batch, tasks)
@@ -0,0 +1,105 @@
+"""
+Serializers
+
+This module contains the registry of the media types the service reads
+request bodies in and writes responses in. JSON is always registered and
+is the default; MessagePack (application/msgpack) is added when the
+msgpack package is installed. A new format only needs a class with a
+media_type, an etag_suffix, load() and response(), registered with
+serializers.register().
+
+Each media type is its own representation of an Order, so its ETag gets
+the etag_suffix ("2" becomes "2-msgpack"); the default, JSON, has none.
+"""
+from flask import current_app
+from service.common.encoders import fast_json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class BodyError(Exception):
+    """Used when a request body cannot be decoded"""
+
+
+class JSONSerializer:
+    """application/json, written exactly like jsonify()"""
+
+    media_type = "application/json"
+    etag_suffix = ""
+
+    def load(self, request):
+        """Returns the decoded body of a request"""
+        return request.get_json()
+
+    def response(self, obj, status, headers=None):
+        """Returns a response with obj as its body"""
+        return fast_json.response(obj, status, headers)
+
+
+class MsgPackSerializer:
+    """application/msgpack for internal callers"""
+
+    media_type = "application/msgpack"
+    etag_suffix = "msgpack"
+
+    def load(self, request):
+        """Returns the decoded body of a request"""
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, msgpack.UnpackException) as error:
+            raise BodyError(f"Invalid MessagePack body: {error}") from error
+
+    def response(self, obj, status, headers=None):
+        """Returns a response with obj as its body"""
+        return current_app.response_class(
+            msgpack.packb(obj, use_bin_type=True),
+            status=status,
+            headers=headers,
+            mimetype=self.media_type,
+        )
+
+
+class SerializerRegistry:
+    """The serializers of the service by media type
+
+    The first one registered is the default, used when a client does not
+    say what it accepts.
+    """
+
+    def __init__(self):
+        self.serializers = {}
+
+    def register(self, serializer):
+        """Adds a serializer for its media type"""
+        self.serializers[serializer.media_type] = serializer
+
+    @property
+    def media_types(self):
+        """The registered media types, the default first"""
+        return list(self.serializers)
+
+    def get(self, media_type):
+        """Returns the serializer of a media type, or None"""
+        return self.serializers.get(media_type)
+
+    def etags(self, tag):
+        """Returns the ETags of a tag in every registered media type"""
+        return [
+            f"{tag}-{serializer.etag_suffix}" if serializer.etag_suffix else tag
+            for serializer in self.serializers.values()
+        ]
+
+    def negotiate(self, accept):
+        """Returns the serializer that best matches an Accept header"""
+        media_type = accept.best_match(self.media_types, default=self.media_types[0])
+        return self.serializers[media_type]
+
+
+# The formats of request and response bodies
+serializers = SerializerRegistry()
+serializers.register(JSONSerializer())
+if msgpack is not None:
+    serializers.register(MsgPackSerializer())
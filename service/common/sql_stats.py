@@ -0,0 +1,151 @@
+"""
+SQL Statistics
+
+This module contains utilities to watch the SQL statements that
+SQLAlchemy sends to the database: a counter for tests, per request
+totals reported in a Server-Timing header, and a slow query log.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+# Literals and bind parameters in a statement, replaced to fingerprint it
+LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\?|\$\d+|\b\d+(?:\.\d+)?\b")
+# Runs of placeholders, as in IN (...) lists and multi-row VALUES
+PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+VALUES_LISTS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+
+
+class QueryCounter:
+    """Counts the SQL statements an engine executes while it is active
+
+    Usage:
+        with QueryCounter(db.engine) as counter:
+            client.get("/orders")
+        assert counter.count == 2
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        """The number of statements executed so far"""
+        return len(self.statements)
+
+    def _before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):  # pylint: disable=too-many-arguments, unused-argument
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+######################################################################
+# Per request totals
+######################################################################
+def _start_statement(
+    conn, cursor, statement, parameters, context, executemany
+):  # pylint: disable=too-many-arguments, unused-argument
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+def _finish_statement(
+    conn, cursor, statement, parameters, context, executemany
+):  # pylint: disable=too-many-arguments, unused-argument
+    elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+    if has_request_context():
+        g.sql_count = g.get("sql_count", 0) + 1
+        g.sql_seconds = g.get("sql_seconds", 0.0) + elapsed
+    if has_app_context():
+        threshold = current_app.config.get("SLOW_QUERY_THRESHOLD_MS")
+        if threshold is not None and elapsed * 1000 >= threshold:
+            log_slow_query(statement, elapsed)
+
+
+def fingerprint(statement):
+    """Returns a statement with its literals and parameters replaced by ?
+
+    Statements that differ only in their values, or in the length of an
+    IN list or a multi-row VALUES, get the same fingerprint.
+    """
+    normalized = " ".join(LITERALS.sub("?", statement).split())
+    normalized = PLACEHOLDER_LISTS.sub("?", normalized)
+    return VALUES_LISTS.sub("(?)", normalized)
+
+
+def log_slow_query(statement, elapsed):
+    """Writes a structured log entry for a statement that ran too long"""
+    normalized = fingerprint(statement)
+    entry = {
+        "event": "slow_query",
+        "fingerprint": hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16],
+        "statement": normalized,
+        "duration_ms": round(elapsed * 1000, 3),
+        "route": None,
+        "method": None,
+    }
+    if has_request_context():
+        entry["route"] = request.url_rule.rule if request.url_rule else request.path
+        entry["method"] = request.method
+    logger.warning("Slow query: %s", json.dumps(entry))
+
+
+def _drop_statement(context):
+    starts = context.connection.info.get("statement_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def track_statements(target=Engine):
+    """Adds the count and run time of every statement to the current request
+
+    Listens on every Engine by default, so engines that Flask-SQLAlchemy
+    creates later are covered too. Calling it twice is harmless.
+    """
+    if not event.contains(target, "before_cursor_execute", _start_statement):
+        event.listen(target, "before_cursor_execute", _start_statement)
+        event.listen(target, "after_cursor_execute", _finish_statement)
+        event.listen(target, "handle_error", _drop_statement)
+
+
+def reset_request_totals():
+    """Starts counting the statements of a new request from zero
+
+    Requests may share one app context (and so one g) with each other,
+    so the totals are reset explicitly when a request starts.
+    """
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+
+
+def request_totals():
+    """Returns the (count, seconds) of the statements run by this request"""
+    return g.get("sql_count", 0), g.get("sql_seconds", 0.0)
+
+
+def server_timing(response):
+    """Adds the SQL count and time of the request to a Server-Timing header"""
+    count, seconds = request_totals()
+    response.headers.add("Server-Timing", f'db;dur={seconds * 1000:.3f};desc="{count} statements"')
+    return response
+
+
+def init_app(app):
+    """Tracks the statements of every request the app handles"""
+    track_statements()
+    app.before_request(reset_request_totals)
+    app.after_request(server_timing)
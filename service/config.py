@@ -12,5 +12,61 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker (DB_POOL_RECYCLE=-1 never recycles)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Server side limit on each statement, 0 turns it off
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+# Set when an external pooler (e.g. PgBouncer in transaction mode) owns the connections
+DB_POOLER_MODE = os.getenv("DB_POOLER_MODE", "false").lower() in ("1", "true", "yes")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Page sizes for list endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming large results
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Rows written per transaction by the bulk endpoints
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+
+# The most groups GET /orders/stats returns, and whether it reads the
+# summary tables when they can answer instead of the order table
+STATS_MAX_GROUPS = int(os.getenv("STATS_MAX_GROUPS", "10000"))
+STATS_FROM_SUMMARIES = os.getenv("STATS_FROM_SUMMARIES", "true").lower() in ("1", "true", "yes")
+
+# Orders checked and merged per transaction by imports, and the most
+# rejected rows POST /orders/import lists in its response
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Encoder of the list endpoints: "auto" (orjson if installed), "orjson" or "stdlib"
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+
+# Response compression: codings in order of preference (zstd and br need
+# the zstandard and brotli packages), gzip level and smallest body to compress
+COMPRESS_ENCODINGS = os.getenv("COMPRESS_ENCODINGS", "zstd,br,gzip")
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+# Read-through cache of serialized Orders: "lru", "shared" or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "lru")
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+
+# How long the response to an Idempotency-Key is kept (seconds), and how
+# many of them each worker keeps in memory
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+
+# Statements that run longer than this are written to the slow query log
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
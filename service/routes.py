@@ -5,27 +5,69 @@ My Service
 Describe what your service does here
 Paths:
 ------
-GET /orders - Returns a list all of the Orders
+GET /orders - Returns a list all of the Orders, one page at a time
+              (or streams all of them with "Accept: application/x-ndjson",
+              or as flattened CSV rows with "Accept: text/csv")
 GET /orders/{id} - Returns the Order with a given id number
+GET /orders/stats - Returns Order counts and revenue, grouped in SQL
 POST /orders - creates a new Order record in the database
+               (once per "Idempotency-Key" header)
+POST /orders/bulk - creates many Order records, one transaction per chunk
+POST /orders/import - loads Orders from CSV or NDJSON with COPY
 PUT /orders/{id} - updates an Order record in the database
 DELETE /orders/{id} - deletes an Order record in the database
-PUT /orders/{id}/cancel - cancel an Order
+PUT /orders/{id}/cancel - cancel an Order (also approve, ship and deliver)
+PUT /orders/cancel - cancels many Orders at once
+PATCH /orders?{filters} - sets the status of every Order that matches the filters
+DELETE /orders?{filters} - deletes every Order that matches the filters
 
 GET /orders/{order_id}/items - Returns a list all of the Items of the given Order id
 GET /orders/{order_id}/items/{item_id} - Returns the Order Item with a given id number
 POST /orders/{order_id}/items - creates a new Order Item record in the database
+POST /orders/{order_id}/items/bulk - creates many Order Item records at once
 PUT /orders/{order_id}/items/{item_id} - updates an Order Item record in the database
 DELETE /orders/{order_id}/items/{item_id} - deletes an Order Item record in the database
+
+GET /diagnostics/cache - Returns the counters of the Order cache
+GET /diagnostics/pool - Returns the settings and usage of the connection pool
+GET /metrics - Returns the request and database metrics for Prometheus
 """
-from flask import jsonify, request, url_for, abort, make_response
+# pylint: disable=too-many-lines
+import csv
+import io
+from datetime import datetime, timezone
+from flask import request, url_for, abort, make_response, stream_with_context
 from service.common import status  # HTTP Status Codes
-from service.models import Order, Item
+from service.common import metrics, pooling
+from service.models import Order, Item, OrderStatus, DataValidationError, db, ORDER_FIELDS, ORDER_TRANSITIONS
+from service.models import ITEM_EXPORT_FIELDS, ORDER_STATS_GROUPS, OrderDailySummary, UserOrderSummary
+from service.models import DuplicateRequestError, IdempotencyKey, idempotent_write
+from service.common.bulk import chunked, read_ndjson
+from service.common.importing import CSV, check_item, check_order, import_orders, read_records
+from service.common.cache import order_cache
+from service.common.compression import etag_matches
+from service.common.encoders import fast_json
+from service.common.idempotency import idempotency_cache, request_fingerprint
+from service.common.serializers import BodyError, serializers
+from service.common.pagination import (
+    InvalidCursorError,
+    decode_cursor,
+    encode_cursor,
+    link_header,
+    parse_limit,
+)
 
 
 # Import Flask application
 from . import app
 
+# Media types that GET /orders can respond with
+NDJSON = "application/x-ndjson"
+LIST_MEDIA_TYPES = serializers.media_types + [NDJSON, CSV]
+
+# The query string parameters of filter_orders()
+ORDER_FILTERS = ("ids", "order_id", "user_id", "status", "name", "created_after", "created_before")
+
 
 ######################################################################
 # GET INDEX
@@ -41,86 +83,485 @@ def index():
 ######################################################################
 
 
-def check_content_type(media_type):
-    """Checks that the media type is correct"""
+def check_content_type(*media_types):
+    """Checks that the media type is correct
+
+    Without arguments any media type with a registered serializer, such
+    as application/json or application/msgpack, is accepted.
+    """
+    media_types = media_types or serializers.media_types
     content_type = request.headers.get("Content-Type")
-    if content_type and content_type == media_type:
+    if content_type and content_type in media_types:
         return
     app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        f"Content-Type must be {media_type}",
+        f"Content-Type must be {' or '.join(media_types)}",
     )
 
 
-######################################################################
-#  R E S T   A P I   E N D P O I N T S
-######################################################################
-######################################################################
-# FIND AN ORDER BY ID OR RETURN ALL ORDERS
-######################################################################
-@app.route("/orders", methods=["GET"])
-def list_orders():
-    """Find an order by ID or Returns all of the Orders"""
-    app.logger.info("Request for Order list")
-    # print(f"request.args = {request.args.to_dict(flat=False)}")
-
-    orders = []  # A list of all orders satisfying requirements
+def read_body():
+    """Returns the request body decoded by the serializer of its Content-Type"""
+    serializer = serializers.get(request.mimetype)
+    if serializer is None:
+        check_content_type()  # aborts with 415
+    try:
+        return serializer.load(request)
+    except BodyError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
 
-    # Process the query string if any
-    # Supported formats:
-    # - All orders: "?"
-    # - A particular order:
-    #       "?order_id={some integer}" or
-    #       "?order_id={some integer}&user_id={user id having this order}"
-    # - All orders of a particular user ID: "?user_id={some integer}"
 
-    # This corresponds to "?"
-    query = Order.query
-    query_params = request.args
+def body_response(obj, code, headers=None, version=None):
+    """Returns obj in the registered media type that the client prefers
 
-    if len(query_params) == 0:
-        orders = Order.all()
+    With the version of an Order, the ETag of that representation is set.
+    """
+    serializer = serializers.negotiate(request.accept_mimetypes)
+    response = serializer.response(obj, code, headers)
+    response.vary.add("Accept")
+    if version is not None:
+        response.set_etag(representation_etag(version))
+    return response
+
+
+def representation_etag(version):
+    """Returns the ETag of a version of an Order in the negotiated media type"""
+    suffix = serializers.negotiate(request.accept_mimetypes).etag_suffix
+    return f"{version}-{suffix}" if suffix else str(version)
+
+
+def parse_ids(values):
+    """Returns the order ids of "?ids=1,2,3", which may be repeated"""
+    try:
+        return [int(value) for text in values for value in text.split(",") if value]
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a comma separated list of integers")
+    return []
+
+
+def parse_time(query_params, name):
+    """Returns an ISO 8601 query string parameter as a datetime, UTC if naive"""
+    try:
+        value = datetime.fromisoformat(query_params.get(name))
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, f"{name} must be an ISO 8601 date or time")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def parse_integer(query_params, name):
+    """Returns an integer query string parameter, aborting with 400 if it is not one"""
+    try:
+        return int(query_params.get(name))
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, f"{name} must be an integer")
+    return None
+
+
+def parse_status(query_params):
+    """Returns the OrderStatus of "?status=", aborting with 400 if there is none"""
+    value = query_params.get("status")
+    if value not in OrderStatus.__members__:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"status must be one of {', '.join(OrderStatus.__members__)}",
+        )
+    return OrderStatus[value]
+
+
+def filter_orders(query, query_params):
+    """Applies the Order filters of a query string to a query"""
+    # This corresponds to "?ids=1,2,3"
+    if "ids" in query_params:
+        query = query.filter(Order.id.in_(parse_ids(query_params.getlist("ids"))))
 
     # This corresponds to "?order_id={some integer}"
     if "order_id" in query_params:
-        order_id = query_params.get("order_id")
+        order_id = parse_integer(query_params, "order_id")
         query = query.filter(Order.id == order_id)
 
     # Check for 'user_id'
     if "user_id" in query_params:
-        user_id = query_params.get("user_id")
+        user_id = parse_integer(query_params, "user_id")
         query = query.filter(Order.user_id == user_id)
 
     # Check for 'status'
     if "status" in query_params:
-        status_ = query_params.get("status")
+        status_ = parse_status(query_params)
         query = query.filter(Order.status == status_)
 
     if "name" in query_params:
         name = query_params.get("name")
         query = query.filter(Order.name == name)
 
-    # Execute the query
-    orders = query.all()
+    # "?created_after=2024-01-01&created_before=2024-02-01" includes the
+    # first bound and excludes the second
+    if "created_after" in query_params:
+        query = query.filter(Order.create_time >= parse_time(query_params, "created_after"))
+    if "created_before" in query_params:
+        query = query.filter(Order.create_time < parse_time(query_params, "created_before"))
+
+    return query
+
+
+def get_bulk_query():
+    """Returns the Order query of a bulk write
+
+    Aborts with 400 without any filter, so a bare PATCH or DELETE /orders
+    cannot change every Order by mistake.
+    """
+    if not any(name in request.args for name in ORDER_FILTERS):
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"At least one filter is required: {', '.join(ORDER_FILTERS)}",
+        )
+    return filter_orders(Order.query, request.args)
+
+
+def get_page_params():
+    """Returns the (limit, after) keyset paging parameters of the request"""
+    try:
+        limit = parse_limit(
+            request.args.get("limit"),
+            app.config["DEFAULT_PAGE_SIZE"],
+            app.config["MAX_PAGE_SIZE"],
+        )
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+
+    cursor = request.args.get("cursor")
+    if not cursor:
+        return limit, None
+    try:
+        return limit, decode_cursor(cursor)
+    except InvalidCursorError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
+
+
+def get_fieldset():
+    """Returns the (fields, include_items) the request asked for
+
+    "?fields=id,status" limits an Order to those fields (the id is always
+    sent) and leaves out its Items unless "?include=items" is also given.
+    Without fields the whole Order is sent, Items included.
+    """
+    fields = [name for value in request.args.getlist("fields") for name in value.split(",") if name]
+    include = [name for value in request.args.getlist("include") for name in value.split(",") if name]
+    unknown = sorted(set(fields) - set(ORDER_FIELDS) - {"items"})
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, f"Unknown fields: {', '.join(unknown)}")
+    if set(include) - {"items"}:
+        abort(status.HTTP_400_BAD_REQUEST, "include only supports: items")
+    if not fields:
+        return ORDER_FIELDS, True
+    include_items = "items" in fields or "items" in include
+    fields = tuple(dict.fromkeys(["id"] + [name for name in fields if name != "items"]))
+    return fields, include_items
+
+
+def select_fields(payload, fields, include_items):
+    """Returns the fields of a serialized Order, and its Items if asked"""
+    order = {field: payload[field] for field in fields}
+    if include_items:
+        order["items"] = payload["items"]
+    return order
+
+
+def get_order_entry(order_id):
+    """Returns the version and the serialized Order with its Items
+
+    The entry comes from the cache when possible. Aborts with 404 if the
+    Order does not exist.
+    """
+    entry = order_cache.get(order_id)
+    if entry is None:
+        order = Order.find_with_items(order_id)
+        if not order:
+            abort(
+                status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found."
+            )
+        entry = {"version": order.version, "order": order.serialize()}
+        order_cache.set(order_id, entry)
+    return entry["version"], entry["order"]
+
+
+def get_order_version(order_id):
+    """Returns the version of an Order without serializing it
+
+    Aborts with 404 if the Order does not exist.
+    """
+    entry = order_cache.get(order_id)
+    if entry is not None:
+        return entry["version"]
+    version = Order.find_version(order_id)
+    if version is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+    return version
+
+
+def not_modified_response(order_id):
+    """Returns a 304 if If-None-Match names the current version of an Order
+
+    The version alone is looked up, so a client whose copy is current gets
+    a 304 without anything being read or serialized. Returns None when the
+    Order has to be sent.
+    """
+    if not request.if_none_match:
+        return None
+    tag = representation_etag(get_order_version(order_id))
+    if not etag_matches(request.if_none_match, tag, weak=True):
+        return None
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.vary.add("Accept")
+    response.set_etag(tag)
+    return response
+
+
+def conditional_order_response(order_id, select):
+    """Returns part of a serialized Order with its version as the ETag
+
+    Args:
+        order_id (int): the id of the Order
+        select (function): picks the part of the serialized Order to send
+    """
+    response = not_modified_response(order_id)
+    if response is not None:
+        return response
+
+    version, payload = get_order_entry(order_id)
+    return body_response(select(payload), status.HTTP_200_OK, version=version)
+
+
+def sparse_order_response(order_id, fields, include_items):
+    """Returns some fields of an Order with its version as the ETag
+
+    A cached Order is cut down to the fields. Otherwise only their
+    columns are selected, and the Items only when they were asked for.
+    The partial Order is not cached.
+    """
+    response = not_modified_response(order_id)
+    if response is not None:
+        return response
+
+    entry = order_cache.get(order_id)
+    if entry is not None:
+        version = entry["version"]
+        payload = select_fields(entry["order"], fields, include_items)
+    else:
+        row = Order.find_row(order_id, fields)
+        if row is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+        version = row.version
+        payload = Order.serialize_rows([row], fields, include_items)[0]
+
+    return body_response(payload, status.HTTP_200_OK, version=version)
+
+
+def stream_orders(query, after=None, fields=ORDER_FIELDS, include_items=True):
+    """Streams the Orders of a query as newline delimited JSON
+
+    Rows are read from a server side cursor in batches of STREAM_BATCH_SIZE,
+    the Items of each batch with one more SELECT, and each batch is sent as
+    soon as it is serialized, so memory stays flat no matter how many
+    Orders match. A cursor from a previous page
+    or from X-Next-Cursor resumes an interrupted export.
+    """
+    result = Order.keyset_rows(
+        query, None, after, fields, yield_per=app.config["STREAM_BATCH_SIZE"]
+    )
+
+    def generate():
+        for rows in result.partitions():
+            orders = Order.serialize_rows(rows, fields, include_items)
+            yield b"".join(fast_json.dumps(order) + b"\n" for order in orders)
+
+    return app.response_class(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype=NDJSON,
+        headers={"Vary": "Accept"},
+    )
+
+
+def stream_csv(query, after=None, fields=ORDER_FIELDS, include_items=True):
+    """Streams the Orders of a query as CSV, one row per Item
+
+    The rows come from Order.export_rows() through a server side cursor,
+    STREAM_BATCH_SIZE at a time, and each batch is sent as soon as it is
+    written, like stream_orders(). Without Items (see get_fieldset())
+    there is one row per Order.
+    """
+    result = Order.export_rows(
+        query, after, fields, include_items, yield_per=app.config["STREAM_BATCH_SIZE"]
+    )
+    columns = fields + ITEM_EXPORT_FIELDS if include_items else fields
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in result.partitions():
+            for row in rows:
+                values = [getattr(row, column) for column in columns]
+                if "create_time" in fields:
+                    values[fields.index("create_time")] = row.create_time.isoformat()
+                writer.writerow(values)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return app.response_class(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype=CSV,
+        headers={"Vary": "Accept", "Content-Disposition": "attachment; filename=orders.csv"},
+    )
+
+
+def daily_summary_stats(group_by, limit):
+    """Returns the Order stats from OrderDailySummary, or None if it cannot tell"""
+    args = request.args
+    order_status = args.get("status")  # checked by order_stats()
+    days = []
+    for name in ("created_after", "created_before"):
+        if name not in args:
+            days.append(None)
+            continue
+        value = parse_time(args, name).astimezone(timezone.utc)
+        if value.time() != datetime.min.time():
+            return None  # the summary only has whole days
+        days.append(value.date())
+    return OrderDailySummary.stats(group_by, order_status, days[0], days[1], limit)
+
+
+def summary_stats(group_by, limit):
+    """Returns the Order stats from the summary tables, or None if they cannot tell
+
+    OrderDailySummary answers for any grouping but user_id, filtered on
+    status and on a created_after/created_before range of whole UTC days.
+    UserOrderSummary answers for totals or a grouping by user_id, filtered
+    on user_id alone. Anything else needs the order table.
+    """
+    filters = {name for name in ORDER_FILTERS if name in request.args}
+    if "user_id" not in group_by and "user_id" not in filters:
+        if filters - {"status", "created_after", "created_before"}:
+            return None
+        return daily_summary_stats(group_by, limit)
+    if set(group_by) - {"user_id"} or filters - {"user_id"}:
+        return None
+    user_id = request.args.get("user_id")
+    if user_id is not None and not user_id.isdigit():
+        return None
+    return UserOrderSummary.stats(group_by, user_id, limit)
+
+
+######################################################################
+#  R E S T   A P I   E N D P O I N T S
+######################################################################
+######################################################################
+# FIND AN ORDER BY ID OR RETURN ALL ORDERS
+######################################################################
+@app.route("/orders", methods=["GET"])
+def list_orders():
+    """Find an order by ID or Returns all of the Orders"""
+    app.logger.info("Request for Order list")
+    # print(f"request.args = {request.args.to_dict(flat=False)}")
+
+    # Process the query string if any
+    # Supported formats:
+    # - All orders: "?"
+    # - A particular order:
+    #       "?order_id={some integer}" or
+    #       "?order_id={some integer}&user_id={user id having this order}"
+    # - All orders of a particular user ID: "?user_id={some integer}"
+    # - Some orders by ID: "?ids=1,2,3"
+    # - Orders created in a range: "?created_after=2024-01-01&created_before=2024-02-01"
+    # - Paging: "?limit={page size}&cursor={next cursor of the last page}"
+    # - Sparse fieldsets: "?fields=id,status,cost_amount&include=items"
+    query_params = request.args
+    query = filter_orders(Order.query, query_params)
+    limit, after = get_page_params()
+    fields, include_items = get_fieldset()
+
+    # "Accept: application/x-ndjson" streams every matching order instead
+    # and "Accept: text/csv" exports them with one row per Item
+    media_type = request.accept_mimetypes.best_match(LIST_MEDIA_TYPES)
+    if media_type == NDJSON:
+        return stream_orders(query, after, fields, include_items)
+    if media_type == CSV:
+        return stream_csv(query, after, fields, include_items)
+
+    # Execute the query one page at a time, as plain rows
+    orders = Order.keyset_rows(query, limit, after, fields).all()
+
+    headers = {"Vary": "Accept"}
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor(last.create_time, last.id)
+        args = query_params.to_dict(flat=False)  # keeps repeated fields= and include=
+        args.update(limit=limit, cursor=next_cursor)
+        next_url = url_for("list_orders", _external=True, **args)
+        headers["Link"] = link_header(next_url, "next")
+        headers["X-Next-Cursor"] = next_cursor
 
     # Return as an array of dictionaries
-    results = [order.serialize() for order in orders]
+    results = Order.serialize_rows(orders, fields, include_items)
 
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    return body_response(results, status.HTTP_200_OK, headers)
 
 
-@app.route("/orders/<order_id>", methods=["GET"])
+@app.route("/orders/<int:order_id>", methods=["GET"])
 def read_an_order(order_id):
     """Find an order by ID or Returns all of the Orders"""
     app.logger.info("Request for Read an Order")
-    order = Order.find(order_id)
+    fields, include_items = get_fieldset()
+    if fields == ORDER_FIELDS and include_items:
+        return conditional_order_response(order_id, lambda order: order)
+    return sparse_order_response(order_id, fields, include_items)
 
-    if order:
-        results = order.serialize()
-        return make_response(jsonify(results), status.HTTP_200_OK)
 
-    abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+######################################################################
+# ORDER STATISTICS
+######################################################################
+@app.route("/orders/stats", methods=["GET"])
+def order_stats():
+    """
+    Returns the count, revenue and average cost of the Orders
+    "?group_by=status,day" groups them by any of status, user_id, day and
+    week (of create_time, in UTC); without it there is one row of totals.
+    The Order filters apply, e.g. "?created_after=2024-01-01". At most
+    "limit" groups are returned (STATS_MAX_GROUPS by default).
+    With STATS_FROM_SUMMARIES the stats are read from the summary tables
+    whenever they can answer (see summary_stats()).
+    """
+    app.logger.info("Request for Order stats")
+    group_by = tuple(
+        dict.fromkeys(name for value in request.args.getlist("group_by") for name in value.split(",") if name)
+    )
+    unknown = sorted(set(group_by) - set(ORDER_STATS_GROUPS))
+    if unknown:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot group by {', '.join(unknown)}, only by {', '.join(ORDER_STATS_GROUPS)}",
+        )
+    try:
+        limit = parse_limit(
+            request.args.get("limit"), app.config["STATS_MAX_GROUPS"], app.config["STATS_MAX_GROUPS"]
+        )
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+    if "status" in request.args:
+        parse_status(request.args)
+
+    results = summary_stats(group_by, limit) if app.config["STATS_FROM_SUMMARIES"] else None
+    if results is None:
+        query = filter_orders(Order.query, request.args)
+        results = Order.stats(query, group_by, limit)
+    return body_response(results, status.HTTP_200_OK)
 
 
 ######################################################################
@@ -133,11 +574,14 @@ def create_orders():
     This endpoint will create an Order based the data in the body that is posted
     """
     app.logger.info("Request to create an Order")
-    check_content_type("application/json")
+    check_content_type()
+    key = request.headers.get("Idempotency-Key")
+    if key:
+        return create_order_once(key)
 
     # Create the order
     order = Order()
-    order.deserialize(request.get_json())
+    order.deserialize(read_body())
     order.create()
 
     # Create a message to return
@@ -145,15 +589,158 @@ def create_orders():
     location_url = url_for("create_orders", order_id=order.id, _external=True)
     # print(location_url)
 
-    return make_response(
-        jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
+    return body_response(message, status.HTTP_201_CREATED, {"Location": location_url})
+
+
+def create_order_once(key):
+    """
+    Creates an Order once per Idempotency-Key
+    A retry with the same key gets the stored response of the first request,
+    from the in-process cache or the idempotency_key table, and nothing is
+    deserialized or written again. Reusing a key for another request body
+    fails with 409.
+    """
+    if len(key) > 255:
+        abort(status.HTTP_400_BAD_REQUEST, "Idempotency-Key must be at most 255 characters")
+    request_hash = request_fingerprint(request)
+    entry = stored_response(key)
+    replayed = entry is not None
+    if entry is None:
+        order = Order()
+        order.deserialize(read_body())
+        try:
+            with idempotent_write(key, request_hash, app.config["IDEMPOTENCY_TTL"]) as record:
+                order.create(commit=False)
+                record.status_code = status.HTTP_201_CREATED
+                record.location = url_for("create_orders", order_id=order.id, _external=True)
+                record.body = order.serialize()
+                entry = record.entry()
+            idempotency_cache.set(key, entry)
+        except DuplicateRequestError:
+            app.logger.info("Idempotency-Key %s was stored by a concurrent request", key)
+            entry = stored_response(key)
+            replayed = True
+
+    if entry is None or entry["request_hash"] != request_hash:
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"Idempotency-Key '{key}' was already used for a different request.",
+        )
+    headers = {"Idempotency-Key": key}
+    if entry["location"]:
+        headers["Location"] = entry["location"]
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return body_response(entry["body"], entry["status"], headers)
+
+
+def stored_response(key):
+    """Returns the response stored under an Idempotency-Key, or None"""
+    entry = idempotency_cache.get(key)
+    if entry is None:
+        record = IdempotencyKey.find(key)
+        if record is not None:
+            entry = record.entry()
+            idempotency_cache.set(key, entry)
+    return entry
+
+
+######################################################################
+# CREATE MANY ORDERS AT ONCE
+######################################################################
+@app.route("/orders/bulk", methods=["POST"])
+def create_orders_in_bulk():
+    """
+    Creates many Orders
+    This endpoint takes a JSON array of Orders, or one Order per line with
+    Content-Type application/x-ndjson, and writes them BULK_CHUNK_SIZE at a
+    time with one transaction per chunk. Each Order is checked against the
+    columns first, like an import, so the database never refuses a chunk.
+    It returns one result per Order: 201 with its id and location, or 400
+    with the validation error.
+    """
+    app.logger.info("Request to create Orders in bulk")
+    if request.headers.get("Content-Type") == NDJSON:
+        records = (
+            (data, {"line": line}) for line, data in read_ndjson(request.stream)
+        )
+    else:
+        check_content_type()
+        data = read_body()
+        if not isinstance(data, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be an array")
+        records = ((order, {}) for order in data)
+
+    results = []
+    for chunk in chunked(records, app.config["BULK_CHUNK_SIZE"]):
+        orders = []
+        created = []
+        for data, result in chunk:
+            result["index"] = len(results)
+            results.append(result)
+            try:
+                if isinstance(data, ValueError):
+                    raise DataValidationError(str(data))
+                order = Order().deserialize(data)
+                check_order(order)
+                orders.append(order)
+                created.append(result)
+            except DataValidationError as error:
+                result.update(status=status.HTTP_400_BAD_REQUEST, error=str(error))
+
+        for result, order_id in zip(created, Order.bulk_create(orders)):
+            result.update(
+                status=status.HTTP_201_CREATED,
+                id=order_id,
+                location=url_for("read_an_order", order_id=order_id, _external=True),
+            )
+
+    failed = sum(result["status"] != status.HTTP_201_CREATED for result in results)
+    app.logger.info("Created %d Orders in bulk, %d rejected", len(results) - failed, failed)
+    return body_response(
+        results, status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+    )
+
+
+######################################################################
+# IMPORT ORDERS
+######################################################################
+@app.route("/orders/import", methods=["POST"])
+def import_orders_from_file():
+    """
+    Imports Orders from CSV or NDJSON
+    The body is read as a stream and IMPORT_CHUNK_SIZE Orders at a time are
+    checked like POST /orders, copied into staging tables and merged with
+    set based SQL. It returns the number of Orders and Items imported and
+    the line number and error of each rejected row (up to
+    IMPORT_MAX_ERRORS of them).
+    """
+    app.logger.info("Request to import Orders")
+    check_content_type(CSV, NDJSON)
+    errors = []
+
+    def rejected(line_number, error, data):  # pylint: disable=unused-argument
+        if len(errors) < app.config["IMPORT_MAX_ERRORS"]:
+            errors.append({"line": line_number, "error": error})
+
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        totals = import_orders(
+            read_records(stream, request.mimetype), app.config["IMPORT_CHUNK_SIZE"], rejected
+        )
+    except UnicodeDecodeError as error:
+        abort(status.HTTP_400_BAD_REQUEST, f"Request body is not valid UTF-8: {error}")
+    totals["errors"] = errors
+    app.logger.info("Imported %d Orders, %d rows rejected", totals["imported"], totals["rejected"])
+    return body_response(
+        totals, status.HTTP_207_MULTI_STATUS if totals["rejected"] else status.HTTP_201_CREATED
     )
 
 
 ######################################################################
 # CREATE A NEW ITEM IN ORDER
 ######################################################################
-@app.route("/orders/<order_id>/items", methods=["POST"])
+@app.route("/orders/<int:order_id>/items", methods=["POST"])
 def create_item_in_an_order(order_id):
     """
     Create an item on an order
@@ -162,30 +749,51 @@ def create_item_in_an_order(order_id):
     This endpoint will add a new item to an order.
     """
     app.logger.info("Request to create an Item for Order with id: %s", order_id)
-    order = Order.find(order_id)
-    if not order:
-        abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
-
     item = Item()
-    item.deserialize(request.get_json())
+    item.deserialize(read_body())
     item.order_id = order_id
     item.amount = 1
-    item.create()
-
-    # order.items.append(item)
-    # order.update()
-    item.order_id = order_id
-    item.update()
+    item.create()  # a missing Order is reported by the foreign key
 
     message = item.serialize()
     location_url = url_for(
         "create_item_in_an_order", order_id=order_id, item_id=item.id, _external=True
     )
     # print(location_url)
-    app.logger.info("Item with ID [%s] created for order: [%s].", item.id, order.id)
-    return make_response(
-        jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
-    )
+    app.logger.info("Item with ID [%s] created for order: [%s].", item.id, order_id)
+    return body_response(message, status.HTTP_201_CREATED, {"Location": location_url})
+
+
+######################################################################
+# CREATE MANY ITEMS IN ORDER
+######################################################################
+@app.route("/orders/<int:order_id>/items/bulk", methods=["POST"])
+def create_items_in_bulk(order_id):
+    """
+    Create many items on an order
+
+    This endpoint takes a JSON array of items and adds all of them to an
+    order with one INSERT and one commit. Nothing is written if any item
+    is invalid, which includes values that do not fit their columns.
+    """
+    app.logger.info("Request to create Items in bulk for Order with id: %s", order_id)
+    check_content_type()
+    data = read_body()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be an array")
+
+    items = []
+    for position, item_data in enumerate(data):
+        try:
+            item = Item().deserialize(item_data)
+            check_item(item)
+            items.append(item)
+        except DataValidationError as error:
+            raise DataValidationError(f"Item {position}: {error}") from error
+
+    items = Item.bulk_create(order_id, items)
+    app.logger.info("%d Items created for order: [%s].", len(items), order_id)
+    return body_response([item.serialize() for item in items], status.HTTP_201_CREATED)
 
 
 ######################################################################
@@ -198,19 +806,19 @@ def update_item(order_id, item_id):
     This endpoint will add an item (specified by item_id) to the specified order
     """
     app.logger.info("Request to update item with ID %d", item_id)
-    check_content_type("application/json")
+    check_content_type()
 
     order = Order.find(order_id)
     if not order:
         abort(status.HTTP_404_NOT_FOUND, "Order not found")
 
     # Check if the item exists
-    data = request.get_json()
+    data = read_body()
 
     item = Item.find(item_id)
     if item is None:
         # Handle the case when the order does not exist
-        return make_response(jsonify(error="Item not found"), status.HTTP_404_NOT_FOUND)
+        return body_response({"error": "Item not found"}, status.HTTP_404_NOT_FOUND)
 
     if "title" in data:
         item.title = data["title"]
@@ -226,32 +834,19 @@ def update_item(order_id, item_id):
         "update_item", order_id=order_id, item_id=item_id, _external=True
     )
 
-    return make_response(
-        jsonify(item.serialize()),
-        status.HTTP_202_ACCEPTED,
-        {"Location": location_url},
-    )
+    return body_response(item.serialize(), status.HTTP_202_ACCEPTED, {"Location": location_url})
 
 
 ######################################################################
 # List all items in an order
 ######################################################################
-@app.route("/orders/<order_id>/items", methods=["GET"])
+@app.route("/orders/<int:order_id>/items", methods=["GET"])
 def list_items_in_one_order(order_id):
     """
     List all items in one order
     """
     app.logger.info("Request for Item list in one order")
-    # order_id = request.args.get("order_id")
-    order = Order.find(order_id)
-    if order:
-        order = order.serialize()
-        results = order["items"]
-        # Process the query string if any
-
-        return make_response(jsonify(results), status.HTTP_200_OK)
-
-    abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+    return conditional_order_response(order_id, lambda order: order["items"])
 
 
 ######################################################################
@@ -262,39 +857,31 @@ def list_one_item_in_one_order(order_id, item_id):
     """
     Get one item in one order
     """
-    app.logger.info("Request for Item list in one order")
-    # order_id = request.args.get("order_id")
-    order = Order.find(order_id)
-    order = order.serialize()
-    results = order["items"]
-    for item in results:
-        if item["id"] == item_id:
-            return make_response(jsonify(item), status.HTTP_200_OK)
-    return make_response(jsonify(error="Item not in Order"), status.HTTP_404_NOT_FOUND)
-    # Process the query string if any
+    app.logger.info("Request for Item %s in Order %s", item_id, order_id)
+    item = Item.find_in_order(order_id, item_id)
+    if item is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Item with id '{item_id}' was not found in Order '{order_id}'.",
+        )
+    return body_response(item.serialize(), status.HTTP_200_OK)
 
 
 ######################################################################
-# List one item in an order
+# Delete one item in an order
 ######################################################################
 @app.route("/orders/<int:order_id>/items/<int:item_id>", methods=["DELETE"])
 def delete_one_item_in_one_order(order_id, item_id):
     """
     Delete one item in one order
     """
-    app.logger.info("Request for Item list in one order")
-    # order_id = request.args.get("order_id")
-    order = Order.find(order_id)
-    if order:
-        order = order.serialize()
-        item = Item.find(item_id)
-        if (item is not None) and (item.order_id == order_id):
-            item.delete()
-            app.logger.info(
-                "Item with ID [%s] and order ID [%s] delete complete.",
-                item_id,
-                order_id,
-            )
+    app.logger.info("Request to delete Item %s in Order %s", item_id, order_id)
+    if Item.delete_in_order(order_id, item_id):
+        app.logger.info(
+            "Item with ID [%s] and order ID [%s] delete complete.",
+            item_id,
+            order_id,
+        )
 
     return make_response("", status.HTTP_204_NO_CONTENT)
 
@@ -306,6 +893,9 @@ def delete_one_item_in_one_order(order_id, item_id):
 def update_an_order(order_id):
     """
     Update information (e.g., address, name) for an order.
+
+    With If-Match the update only happens if the order still has that
+    ETag, otherwise it fails with 412 Precondition Failed.
     """
     app.logger.info("Update order information with ID: %d", order_id)
 
@@ -315,8 +905,17 @@ def update_an_order(order_id):
     if not order:
         abort(status.HTTP_404_NOT_FOUND, "Order not found")
 
+    # Any representation of the current version will do
+    if request.if_match and not any(
+        etag_matches(request.if_match, tag) for tag in serializers.etags(str(order.version))
+    ):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"Order with id '{order_id}' was changed since it was read.",
+        )
+
     # Update the 'name' and 'address' fields of the order
-    data = request.get_json()
+    data = read_body()
     if "name" in data:
         order.name = data["name"]
     if "address" in data:
@@ -324,10 +923,10 @@ def update_an_order(order_id):
     if "status" in data:
         order.status = data["status"]
 
-    order.update()
+    order.update()  # a concurrent write fails with StaleDataError (412)
 
-    return make_response(
-        jsonify(order.serialize()), status.HTTP_200_OK, {"Updated_order_id": order_id}
+    return body_response(
+        order.serialize(), status.HTTP_200_OK, {"Updated_order_id": order_id}, version=order.version
     )
 
 
@@ -349,20 +948,140 @@ def delete_an_order(order_id):
 
 
 ######################################################################
-# CANCEL AN ORDER
+# CANCEL, APPROVE, SHIP OR DELIVER AN ORDER
 ######################################################################
-@app.route("/orders/<int:order_id>/cancel", methods=["PUT"])
-def cancel_an_order(order_id):
+@app.route(f"/orders/<int:order_id>/<any({', '.join(ORDER_TRANSITIONS)}):action>", methods=["PUT"])
+def change_order_status(order_id, action):
     """
-    Cancel an order by order ID.
+    Cancel, approve, ship or deliver an order by order ID.
+
+    The status is checked and changed by one UPDATE, so it fails with 409
+    Conflict if the order's status does not allow the action, for example
+    canceling an order that was already shipped.
     """
-    app.logger.info("Cancel an order with order ID %d", order_id)
-    order = Order.find(order_id)
+    app.logger.info("Request to %s an order with order ID %d", action, order_id)
+    rows = Order.transition([order_id], action)
+    if not rows:
+        current = Order.find_statuses([order_id]).get(order_id)
+        if current is None:
+            abort(status.HTTP_404_NOT_FOUND, "Order not found")
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"Cannot {action} Order with id '{order_id}' in status {current}.",
+        )
 
-    if not order:
-        abort(status.HTTP_404_NOT_FOUND, "Order not found")
-    else:
-        order.status = "CANCELED"
+    return body_response(Order.serialize_rows(rows)[0], status.HTTP_200_OK, version=rows[0].version)
 
-    order.update()
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+
+######################################################################
+# CANCEL MANY ORDERS AT ONCE
+######################################################################
+@app.route("/orders/cancel", methods=["PUT"])
+def cancel_orders():
+    """
+    Cancels many Orders
+    This endpoint takes {"ids": [...]} with up to BULK_CHUNK_SIZE order ids
+    and cancels all of them that can be canceled with a single UPDATE. It
+    returns the ids that were canceled, those whose status does not allow
+    it (conflict) and those that do not exist (not_found).
+    """
+    app.logger.info("Request to cancel Orders in bulk")
+    check_content_type()
+    data = read_body()
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(
+        isinstance(order_id, int) and not isinstance(order_id, bool) for order_id in ids
+    ):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must have an array of integer ids")
+    if len(ids) > app.config["BULK_CHUNK_SIZE"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"At most {app.config['BULK_CHUNK_SIZE']} ids can be canceled at once",
+        )
+
+    ids = list(dict.fromkeys(ids))
+    canceled = {row.id for row in Order.transition(ids, "cancel")} if ids else set()
+    rest = [order_id for order_id in ids if order_id not in canceled]
+    existing = Order.find_statuses(rest) if rest else {}
+    app.logger.info("Canceled %d of %d Orders in bulk", len(canceled), len(ids))
+    return body_response(
+        {
+            "canceled": [order_id for order_id in ids if order_id in canceled],
+            "conflict": [order_id for order_id in rest if order_id in existing],
+            "not_found": [order_id for order_id in rest if order_id not in existing],
+        },
+        status.HTTP_200_OK,
+    )
+
+
+######################################################################
+# UPDATE THE STATUS OF MANY ORDERS
+######################################################################
+@app.route("/orders", methods=["PATCH"])
+def update_orders():
+    """
+    Sets the status of every Order that matches the query string filters
+    This endpoint takes {"status": "SHIPPED"} and the filters of GET /orders,
+    at least one of them, e.g. PATCH /orders?status=APPROVED&user_id=7. The
+    Orders are updated by set based UPDATEs of BULK_CHUNK_SIZE Orders, one
+    transaction each. Only Orders that an action of ORDER_TRANSITIONS could
+    move to the status are updated (e.g. not a DELIVERED Order back to NEW);
+    the numbers updated and skipped are returned.
+    """
+    app.logger.info("Request to update the status of Orders in bulk")
+    query = get_bulk_query()
+    check_content_type()
+    data = read_body()
+    new_status = data.get("status") if isinstance(data, dict) else None
+    if new_status not in OrderStatus.__members__:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"status must be one of {', '.join(OrderStatus.__members__)}",
+        )
+
+    updated, skipped = Order.update_status_where(
+        query, OrderStatus[new_status], app.config["BULK_CHUNK_SIZE"]
+    )
+    app.logger.info("Updated the status of %d Orders to %s, skipped %d", updated, new_status, skipped)
+    return body_response({"updated": updated, "skipped": skipped}, status.HTTP_200_OK)
+
+
+######################################################################
+# DELETE MANY ORDERS
+######################################################################
+@app.route("/orders", methods=["DELETE"])
+def delete_orders():
+    """
+    Deletes every Order that matches the query string filters
+    This endpoint takes the filters of GET /orders, at least one of them,
+    e.g. DELETE /orders?ids=1,2,3. The Orders are deleted BULK_CHUNK_SIZE
+    at a time, and the database removes their Items through the cascading
+    foreign key. The number of Orders deleted is returned.
+    """
+    app.logger.info("Request to delete Orders in bulk")
+    query = get_bulk_query()
+    count = Order.delete_where(query, app.config["BULK_CHUNK_SIZE"])
+    app.logger.info("Deleted %d Orders in bulk", count)
+    return body_response({"deleted": count}, status.HTTP_200_OK)
+
+
+######################################################################
+# DIAGNOSTICS
+######################################################################
+@app.route("/diagnostics/cache", methods=["GET"])
+def cache_stats():
+    """Returns the hit, miss and eviction counters of the Order cache"""
+    return body_response(order_cache.stats(), status.HTTP_200_OK)
+
+
+@app.route("/diagnostics/pool", methods=["GET"])
+def pool_stats():
+    """Returns the settings and usage of the database connection pool"""
+    return body_response(pooling.pool_stats(db.engine, app.config), status.HTTP_200_OK)
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Returns the request and database metrics in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return make_response(body, status.HTTP_200_OK, {"Content-Type": content_type})
@@ -0,0 +1,56 @@
+"""
+Test cases for the benchmark results and load generator helpers
+
+"""
+import argparse
+from unittest import TestCase
+from benchmarks.load import parse_mix
+from benchmarks.results import compare, percentile, summarize
+
+
+def run(**results):
+    """Returns a saved run with the given summaries"""
+    return {"benchmark": "micro", "commit": None, "results": results}
+
+
+######################################################################
+#  B E N C H M A R K   T E S T   C A S E S
+######################################################################
+class TestBenchmarkResults(TestCase):
+    """Test Cases for the benchmark helpers"""
+
+    def test_percentile(self):
+        """It should interpolate percentiles between ranks"""
+        values = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.assertEqual(percentile(values, 0.5), 3.0)
+        self.assertEqual(percentile(values, 0.99), 4.96)
+        self.assertEqual(percentile(values, 1.0), 5.0)
+        self.assertEqual(percentile([7.0], 0.95), 7.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_summarize(self):
+        """It should summarize latencies in milliseconds and calls per second"""
+        summary = summarize([0.003, 0.001, 0.002, 0.004], 0.5, errors=1)
+        self.assertEqual(summary["requests"], 4)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["rps"], 8.0)
+        self.assertEqual(summary["mean_ms"], 2.5)
+        self.assertEqual(summary["p50_ms"], 2.5)
+        self.assertEqual(summary["max_ms"], 4.0)
+        self.assertEqual(summarize([], 0)["p99_ms"], 0.0)
+
+    def test_compare(self):
+        """It should flag slower percentiles and lower throughput as regressions"""
+        before = {"rps": 100.0, "p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 0.0}
+        after = {"rps": 80.0, "p50_ms": 10.5, "p95_ms": 30.0, "p99_ms": 5.0}
+        rows = compare(run(read=before, gone=before), run(read=after, new=after), 10)
+        flagged = {row[1]: row[-1] for row in rows}
+        self.assertEqual(flagged, {"rps": True, "p50_ms": False, "p95_ms": True})
+        self.assertEqual(rows[0][4], -20.0)
+
+    def test_parse_mix(self):
+        """It should parse the weights of the load mix"""
+        self.assertEqual(parse_mix("list=60, read=40,cancel=0"), (["list", "read"], [60.0, 40.0]))
+        for text in ("list=1,refund=1", "list=many", "list=0"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_mix(text)
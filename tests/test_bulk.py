@@ -0,0 +1,33 @@
+"""
+Test cases for the bulk helpers
+
+"""
+import io
+from unittest import TestCase
+from service.common.bulk import chunked, copy_text, escape, read_ndjson
+
+
+######################################################################
+#  B U L K   T E S T   C A S E S
+######################################################################
+class TestBulk(TestCase):
+    """Test Cases for the bulk helpers"""
+
+    def test_chunked(self):
+        """It should split an iterable into lists"""
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_read_ndjson(self):
+        """It should read one object per line and report bad lines"""
+        records = list(read_ndjson(io.StringIO('{"a": 1}\n\nnot json\n[2]\n')))
+        self.assertEqual([line for line, _ in records], [1, 3, 4])
+        self.assertEqual(records[0][1], {"a": 1})
+        self.assertIsInstance(records[1][1], ValueError)
+
+    def test_copy_text(self):
+        """It should escape values for COPY"""
+        self.assertEqual(escape("1 Main St\nNY\tUS\\"), "1 Main St\\nNY\\tUS\\\\")
+        self.assertEqual(escape(12.5), "12.5")
+        self.assertEqual(escape(None), "\\N")
+        self.assertEqual(copy_text([(1, "a\nb"), (2, None)]).getvalue(), "1\ta\\nb\n2\t\\N\n")
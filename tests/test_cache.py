@@ -0,0 +1,136 @@
+"""
+Test cases for the Order cache
+
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache, SharedCache, InMemoryStore, OrderCache
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock the tests can move forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeApp:  # pylint: disable=too-few-public-methods
+    """Just enough of a Flask app for OrderCache.init_app()"""
+
+    def __init__(self, **config):
+        self.config = config
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """Test Cases for the in-process LRU cache"""
+
+    def test_get_and_set(self):
+        """It should return what was stored and count hits and misses"""
+        cache = LRUCache(maxsize=2)
+        self.assertIsNone(cache.get("1"))
+        cache.set("1", {"id": 1})
+        self.assertEqual(cache.get("1"), {"id": 1})
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        cache = LRUCache(maxsize=2)
+        cache.set("1", 1)
+        cache.set("2", 2)
+        cache.get("1")
+        cache.set("3", 3)
+        self.assertIsNone(cache.get("2"))
+        self.assertEqual(cache.get("1"), 1)
+        self.assertEqual(cache.get("3"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        """It should not return entries older than the TTL"""
+        clock = FakeClock()
+        cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("1", 1)
+        clock.now = 9
+        self.assertEqual(cache.get("1"), 1)
+        clock.now = 10
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_delete_and_clear(self):
+        """It should delete one entry or all of them"""
+        cache = LRUCache()
+        cache.set("1", 1)
+        cache.set("2", 2)
+        cache.delete("1")
+        cache.delete("missing")
+        self.assertIsNone(cache.get("1"))
+        cache.clear()
+        self.assertIsNone(cache.get("2"))
+
+
+class TestSharedCache(TestCase):
+    """Test Cases for the shared cache with the in-memory store"""
+
+    def test_round_trip(self):
+        """It should store JSON values in the shared store"""
+        store = InMemoryStore()
+        cache = SharedCache(store, ttl=5)
+        self.assertIsNone(cache.get("1"))
+        cache.set("1", {"id": 1, "items": []})
+        self.assertEqual(store.get("orders:cache:1"), '{"id": 1, "items": []}')
+        self.assertEqual(cache.get("1"), {"id": 1, "items": []})
+
+        # A second worker sees the entry and the invalidation
+        other = SharedCache(store, ttl=5)
+        self.assertEqual(other.get("1"), {"id": 1, "items": []})
+        other.delete("1")
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.stats(), {"backend": "shared", "hits": 1, "misses": 2, "evictions": None})
+
+    def test_expiry_and_clear(self):
+        """It should expire entries and only clear its own keys"""
+        clock = FakeClock()
+        store = InMemoryStore(clock=clock)
+        cache = SharedCache(store, ttl=5)
+        cache.set("1", 1)
+        cache.set("2", 2)
+        store.set("other:key", "x")
+        clock.now = 4
+        self.assertEqual(cache.get("1"), 1)
+        cache.clear()
+        self.assertIsNone(cache.get("2"))
+        self.assertEqual(store.get("other:key"), "x")
+        cache.set("3", 3)
+        clock.now = 10
+        self.assertIsNone(cache.get("3"))
+
+
+class TestOrderCache(TestCase):
+    """Test Cases for choosing the cache backend"""
+
+    def test_backends(self):
+        """It should build the configured backend"""
+        cache = OrderCache()
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.stats(), {"backend": "none"})
+
+        cache.init_app(FakeApp(CACHE_BACKEND="lru", CACHE_MAXSIZE=10, CACHE_TTL=5))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get("1"), {"id": 1})
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+
+        cache.init_app(FakeApp(CACHE_BACKEND="shared", CACHE_URL="memory://"))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get(1), {"id": 1})
+        self.assertEqual(cache.stats()["backend"], "shared")
+
+        cache.init_app(FakeApp(CACHE_BACKEND="none"))
+        self.assertIsNone(cache.get(1))
+        self.assertRaises(ValueError, cache.init_app, FakeApp(CACHE_BACKEND="disk"))
@@ -2,10 +2,16 @@
 CLI Command Extensions for Flask
 """
 import os
+import json
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import (
+    db_create, db_explain, db_import, db_seed, db_upgrade, idempotency_purge, seq_scans, summary_rebuild
+)
+from service.models import Item, Order, db
+from tests.factories import ItemFactory, OrderFactory
 
 
 class TestFlaskCLI(TestCase):
@@ -14,6 +20,13 @@ class TestFlaskCLI(TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
+    def tearDown(self):
+        """Removes the orders the commands wrote"""
+        db.session.query(Order).delete()
+        db.session.query(Item).delete()
+        db.session.commit()
+        db.session.remove()
+
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
         """It should call the db-create command"""
@@ -21,3 +34,84 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.create_missing_indexes')
+    @patch('service.common.cli_commands.upgrade_schema')
+    def test_db_upgrade(self, upgrade_mock, indexes_mock):
+        """It should upgrade the schema and build the missing indexes"""
+        indexes_mock.return_value = ["ix_order_status"]
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0, result.output)
+        upgrade_mock.assert_called_once()
+        self.assertIn("Created 1 index(es)\n  ix_order_status", result.output)
+
+    def test_db_explain(self):
+        """It should find an index for every standard query shape"""
+        result = self.runner.invoke(db_explain)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertNotIn("SEQ SCAN", result.output)
+        self.assertIn("orders by user_id", result.output)
+
+    def test_db_seed(self):
+        """It should add generated orders and items with parallel workers"""
+        orders, items = Order.query.count(), Item.query.count()
+        for method in ("copy", "insert"):
+            result = self.runner.invoke(
+                db_seed,
+                ["--orders", "50", "--items-per-order", "2", "--workers", "2", "--batch-size", "20", "--method", method],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Seeded 50 orders and 100 items", result.output)
+            self.assertIn("rows/s", result.output)
+        self.assertEqual(Order.query.count(), orders + 100)
+        self.assertEqual(Item.query.count(), items + 200)
+
+    def test_db_import(self):
+        """It should import orders from a file and write the rejected rows"""
+        orders = [OrderFactory().serialize() for _ in range(3)]
+        orders[0]["items"] = [ItemFactory().serialize()]
+        orders[2]["cost_amount"] = "lots"
+        count = Order.query.count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "orders.ndjson")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("".join(json.dumps(order) + "\n" for order in orders))
+            result = self.runner.invoke(db_import, [path, "--chunk-size", "2"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Imported 2 orders and 1 items", result.output)
+            self.assertIn("Rejected 1 row(s)", result.output)
+            with open(f"{path}.errors.ndjson", encoding="utf-8") as file:
+                errors = [json.loads(line) for line in file]
+        self.assertEqual([error["line"] for error in errors], [3])
+        self.assertEqual(errors[0]["record"]["cost_amount"], "lots")
+        self.assertEqual(Order.query.count(), count + 2)
+
+    @patch('service.common.cli_commands.IdempotencyKey')
+    def test_idempotency_purge(self, key_mock):
+        """It should delete the expired idempotency keys"""
+        key_mock.purge_expired.return_value = 3
+        result = self.runner.invoke(idempotency_purge)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Deleted 3 expired", result.output)
+
+    @patch('service.common.cli_commands.rebuild_summaries')
+    def test_summary_rebuild(self, rebuild_mock):
+        """It should rebuild the order summaries"""
+        rebuild_mock.return_value = (12, 7)
+        result = self.runner.invoke(summary_rebuild)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Rebuilt 12 daily and 7 user summary row(s)", result.output)
+
+    def test_seq_scans(self):
+        """It should find Seq Scan nodes anywhere in a query plan"""
+        plan = {
+            "Node Type": "Nested Loop",
+            "Plans": [
+                {"Node Type": "Index Scan", "Relation Name": "order"},
+                {
+                    "Node Type": "Hash",
+                    "Plans": [{"Node Type": "Seq Scan", "Relation Name": "item"}],
+                },
+            ],
+        }
+        self.assertEqual(list(seq_scans(plan)), ["item"])
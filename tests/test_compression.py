@@ -0,0 +1,68 @@
+"""
+Test cases for the response compression helpers
+
+"""
+import gzip
+import zlib
+from unittest import TestCase
+import brotli
+import zstandard
+from service.common.compression import available_codecs, compress_stream
+
+
+class Chunks:
+    """An iterable of chunks that records being closed"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        """Marks the chunks closed"""
+        self.closed = True
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Test Cases for the compression helpers"""
+
+    def test_available_codecs(self):
+        """It should load the codecs in order of preference"""
+        codecs = available_codecs(["gzip", "zstd", "br"], 9)
+        self.assertEqual([codec.name for codec in codecs], ["gzip", "zstd", "br"])
+        self.assertEqual(codecs[0].level, 9)
+        self.assertRaises(ValueError, available_codecs, ["gzip", "lzma"], 6)
+
+    def test_compress_stream(self):
+        """It should compress chunks as they come and close the source"""
+        decoders = {
+            "gzip": gzip.decompress,
+            "br": brotli.decompress,
+            "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        }
+        lines = [f'{{"id":{number}}}\n' for number in range(1000)]
+        for codec in available_codecs(["gzip", "br", "zstd"], 6):
+            chunks = Chunks(lines)
+            data = b"".join(compress_stream(chunks, codec.compressobj()))
+            self.assertEqual(decoders[codec.name](data), "".join(lines).encode("utf-8"))
+            self.assertTrue(chunks.closed)
+
+    def test_compress_stream_sync(self):
+        """It should flush each chunk so it decodes before the stream ends"""
+        decoders = {
+            "gzip": lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+            "br": brotli.Decompressor,
+            "zstd": lambda: zstandard.ZstdDecompressor().decompressobj(),
+        }
+        chunks = [b'{"id":1}\n', b'{"id":2}\n']
+        for codec in available_codecs(["gzip", "br", "zstd"], 6):
+            stream = compress_stream(chunks, codec.compressobj())
+            decoder = decoders[codec.name]()
+            decode = decoder.process if codec.name == "br" else decoder.decompress
+            for chunk in chunks:
+                self.assertEqual(decode(next(stream)), chunk)
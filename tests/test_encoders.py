@@ -0,0 +1,39 @@
+"""
+Test cases for the JSON encoders
+
+"""
+from unittest import TestCase
+from flask import jsonify
+from service import app
+from service.common.encoders import OrjsonEncoder, StdlibEncoder, load_encoder
+
+PAYLOADS = [
+    [{"id": 1, "name": "Order", "cost_amount": 145.660919534, "items": [], "user_id": None}],
+    {"b": 1, "a": [1.5, -0.0, 0.1, 0.0001, True]},
+    {"name": "Zoë ☃ \"quoted\" \\ \n\t\x01 /"},
+    {"small": 1.5e-05, "large": 1e16, "huge": 1.2345678901234568e17, "tiny": 5e-324},
+    {"text": "1e5 and 0.00001 in a string"},
+    {"big": 2**70},
+]
+
+
+######################################################################
+#  E N C O D E R   T E S T   C A S E S
+######################################################################
+class TestEncoders(TestCase):
+    """Test Cases for the JSON encoders"""
+
+    def test_match_jsonify(self):
+        """It should encode exactly like jsonify() with every encoder"""
+        for encoder in (StdlibEncoder(), OrjsonEncoder()):
+            for payload in PAYLOADS:
+                with app.app_context():
+                    expected = jsonify(payload).data
+                self.assertEqual(encoder.dumps(payload) + b"\n", expected, (encoder.name, payload))
+
+    def test_load_encoder(self):
+        """It should load the configured encoder"""
+        self.assertEqual(load_encoder("auto").name, "orjson")
+        self.assertEqual(load_encoder("orjson").name, "orjson")
+        self.assertEqual(load_encoder("stdlib").name, "stdlib")
+        self.assertRaises(ValueError, load_encoder, "simplejson")
@@ -0,0 +1,49 @@
+"""
+Test cases for the Idempotency-Key helpers
+
+"""
+import time
+from unittest import TestCase
+from flask import request
+from service import app
+from service.common.idempotency import ResponseCache, request_fingerprint
+
+
+class FakeApp:  # pylint: disable=too-few-public-methods
+    """Just enough of a Flask app for ResponseCache.init_app()"""
+
+    def __init__(self, **config):
+        self.config = config
+
+
+######################################################################
+#  I D E M P O T E N C Y   T E S T   C A S E S
+######################################################################
+class TestIdempotency(TestCase):
+    """Test Cases for the idempotency helpers"""
+
+    def test_response_cache(self):
+        """It should cache stored responses until their key expires"""
+        cache = ResponseCache()
+        cache.set("key", {"expires": time.time() + 60})
+        self.assertIsNone(cache.get("key"))  # not bound to an app yet
+
+        cache.init_app(FakeApp(IDEMPOTENCY_TTL=60, IDEMPOTENCY_CACHE_SIZE=2))
+        cache.set("key", {"status": 201, "expires": time.time() + 60})
+        cache.set("expired", {"status": 201, "expires": time.time() - 1})
+        self.assertEqual(cache.get("key")["status"], 201)
+        self.assertIsNone(cache.get("expired"))
+        cache.clear()
+        self.assertIsNone(cache.get("key"))
+
+    def test_request_fingerprint(self):
+        """It should fingerprint the method, path, media type and body"""
+        def fingerprint(path="/orders", method="POST", **kwargs):
+            with app.test_request_context(path, method=method, **kwargs):
+                return request_fingerprint(request)
+
+        first = fingerprint(json={"name": "A"})
+        self.assertEqual(fingerprint(json={"name": "A"}), first)
+        self.assertNotEqual(fingerprint(json={"name": "B"}), first)
+        self.assertNotEqual(fingerprint("/orders/bulk", json={"name": "A"}), first)
+        self.assertNotEqual(fingerprint(data=b'{"name": "A"}', content_type="text/plain"), first)
@@ -0,0 +1,47 @@
+"""
+Test cases for the Order import helpers
+
+"""
+import io
+from unittest import TestCase
+from service.models import DataValidationError, Order
+from service.common.importing import check_column, read_csv, read_records
+
+
+######################################################################
+#  I M P O R T I N G   T E S T   C A S E S
+######################################################################
+class TestImporting(TestCase):
+    """Test Cases for the Order import helpers"""
+
+    def test_read_csv(self):
+        """It should read CSV rows with the line they start on"""
+        text = 'name,address,items\nA,"1 Main St\nNY",[]\nB,here,\nC,there,[bad\n'
+        records = list(read_csv(io.StringIO(text)))
+        self.assertEqual([line for line, _ in records], [2, 4, 5])
+        self.assertEqual(records[0][1], {"name": "A", "address": "1 Main St\nNY", "items": []})
+        self.assertEqual(records[1][1]["items"], [])
+        self.assertIsInstance(records[2][1], ValueError)
+
+    def test_read_records(self):
+        """It should only read CSV or NDJSON"""
+        records = list(read_records(io.StringIO('{"a": 1}\n'), "application/x-ndjson"))
+        self.assertEqual(records, [(1, {"a": 1})])
+        self.assertRaises(ValueError, read_records, io.StringIO(""), "application/json")
+
+    def test_check_column(self):
+        """It should convert values to their column types and check lengths"""
+        columns = Order.__table__.c
+        self.assertEqual(check_column("Order", columns.user_id, " 42 "), 42)
+        self.assertEqual(check_column("Order", columns.cost_amount, "9.5"), 9.5)
+        self.assertEqual(check_column("Order", columns.address, "here"), "here")
+        self.assertRaises(DataValidationError, check_column, "Order", columns.user_id, "x")
+        self.assertRaises(DataValidationError, check_column, "Order", columns.user_id, True)
+        self.assertRaises(DataValidationError, check_column, "Order", columns.cost_amount, [1])
+        self.assertRaises(DataValidationError, check_column, "Order", columns.name, "x" * 100)
+        self.assertEqual(check_column("Order", columns.user_id, 2**31 - 1), 2**31 - 1)
+        self.assertRaises(DataValidationError, check_column, "Order", columns.user_id, 2**31)
+        self.assertRaises(DataValidationError, check_column, "Order", columns.user_id, "-99999999999")
+        self.assertRaises(DataValidationError, check_column, "Order", columns.address, "1 Main St\x00")
+        self.assertRaises(DataValidationError, check_column, "Order", columns.address, None)
+        self.assertIsNone(check_column("Order", columns.name, None))
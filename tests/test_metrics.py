@@ -0,0 +1,51 @@
+"""
+Test cases for the metrics helpers
+
+"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import metrics
+
+
+class FakePool:  # pylint: disable=too-few-public-methods
+    """Just enough of a connection pool for instrument_pool()"""
+
+    def __init__(self):
+        self.checkouts = 0
+
+    def connect(self):
+        """Hands out a connection"""
+        self.checkouts += 1
+        return "connection"
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Test Cases for the metrics helpers"""
+
+    def test_instrument_pool(self):
+        """It should time every checkout from a pool exactly once"""
+        pool = FakePool()
+        before = metrics.REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count")
+        metrics.instrument_pool(pool)
+        metrics.instrument_pool(pool)
+        self.assertEqual(pool.connect(), "connection")
+        self.assertEqual(pool.checkouts, 1)
+        self.assertEqual(
+            metrics.REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count"), before + 1
+        )
+
+    def test_render_multiprocess(self):
+        """It should collect the files of every worker in multiprocess mode"""
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                body, content_type = metrics.render()
+        self.assertEqual(body, b"")
+        self.assertTrue(content_type.startswith("text/plain"))
+
+        body, _ = metrics.render()
+        self.assertIn(b"http_requests_total", body)
@@ -5,9 +5,15 @@ Test cases for Order Model
 import logging
 import unittest
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text, update
+from sqlalchemy.exc import DataError
+from sqlalchemy.orm.exc import StaleDataError
 from service import app
-from service.models import Order, Item, DataValidationError, db
+from service.models import Order, Item, OrderStatus, DataValidationError, OrderNotFoundError, db
+from service.models import DuplicateRequestError, IdempotencyKey, idempotent_write
+from service.models import OrderDailySummary, UserOrderSummary, rebuild_summaries
+from service.models import create_missing_indexes, upgrade_schema
 from tests.factories import OrderFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -18,7 +24,7 @@ DATABASE_URI = os.getenv(
 ######################################################################
 #  Order   M O D E L   T E S T   C A S E S
 ######################################################################
-class TestOrder(unittest.TestCase):
+class TestOrder(unittest.TestCase):  # pylint: disable=too-many-public-methods
     """Test Cases for Order Model"""
 
     @classmethod
@@ -307,3 +313,252 @@ class TestOrder(unittest.TestCase):
         # Fetch it back again
         order = Order.find(order.id)
         self.assertEqual(len(order.items), 0)
+
+    def test_deserialize_with_bad_status_or_time(self):
+        """It should not Deserialize an order with an unknown status or a bad create_time"""
+        data = OrderFactory().serialize()
+        data["status"] = "LOST"
+        self.assertRaises(DataValidationError, Order().deserialize, data)
+        data = OrderFactory().serialize()
+        data["create_time"] = "yesterday"
+        self.assertRaises(DataValidationError, Order().deserialize, data)
+        data = ItemFactory().serialize()
+        data["status"] = "GONE"
+        self.assertRaises(DataValidationError, Item().deserialize, data)
+
+    def test_deserialize_non_finite_numbers(self):
+        """It should not Deserialize a NaN or infinite cost_amount or price"""
+        for value in (float("nan"), float("inf"), "-Infinity"):
+            data = OrderFactory().serialize()
+            data["cost_amount"] = value
+            self.assertRaises(DataValidationError, Order().deserialize, data)
+            data = ItemFactory().serialize()
+            data["price"] = value
+            self.assertRaises(DataValidationError, Item().deserialize, data)
+        data = OrderFactory().serialize()
+        data["cost_amount"] = "12.5"
+        self.assertEqual(Order().deserialize(data).cost_amount, "12.5")
+
+    def test_bulk_create_orders(self):
+        """It should Create many orders with their items in one transaction"""
+        orders = []
+        for count in range(3):
+            order = OrderFactory()
+            data = order.serialize()
+            data["items"] = [ItemFactory().serialize() for _ in range(count)]
+            orders.append(Order().deserialize(data))
+
+        ids = Order.bulk_create(orders)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(set(ids)), 3)
+        for count, order_id in enumerate(ids):
+            order = Order.find(order_id)
+            self.assertEqual(order.name, orders[count].name)
+            self.assertEqual(len(order.items), count)
+        self.assertEqual(Order.bulk_create([]), [])
+
+    def test_order_version(self):
+        """It should bump the version on every write to an order or its items"""
+        order = OrderFactory()
+        order.create()
+        self.assertEqual(order.version, 1)
+        self.assertEqual(Order.find_version(order.id), 1)
+        self.assertIsNone(Order.find_version(order.id + 1000))
+
+        order.name = "Renamed"
+        order.update()
+        self.assertEqual(Order.find_version(order.id), 2)
+
+        item = ItemFactory(order=order)
+        item.create()
+        self.assertEqual(Order.find_version(order.id), 3)
+        items = [ItemFactory(order=None) for _ in range(3)]
+        Item.bulk_create(order.id, items)
+        self.assertEqual(Order.find_version(order.id), 4)
+        item = Item.find(item.id)
+        item.delete()
+        self.assertEqual(Order.find_version(order.id), 5)
+
+        # Orders created in the same transaction as their Items are not bumped
+        order = OrderFactory()
+        order.items = [ItemFactory(order=None) for _ in range(2)]
+        Order.bulk_create([order])
+        self.assertEqual(Order.find_version(order.id), 1)
+        Item.bulk_create(order.id, [ItemFactory(order=None)])
+        self.assertEqual(Order.find_version(order.id), 2)
+
+    def test_bulk_create_items_refused(self):
+        """It should roll back Items the database refuses and report missing Orders"""
+        order = OrderFactory()
+        order.create()
+        items = [ItemFactory(order=None) for _ in range(2)]
+        items[1].amount = 2**40
+        self.assertRaises(DataError, Item.bulk_create, order.id, items)
+        self.assertEqual(Item.query.count(), 0)  # the session is usable again
+        self.assertRaises(OrderNotFoundError, Item.bulk_create, order.id + 1000, [])
+        self.assertEqual(Item.bulk_create(order.id, []), [])
+
+    def test_update_stale_order(self):
+        """It should not Update an order that changed since it was read"""
+        order = OrderFactory()
+        order.create()
+        order = Order.find(order.id)
+        db.session.execute(
+            text('UPDATE "order" SET name = :name WHERE id = :id'),
+            {"name": "Elsewhere", "id": order.id},
+        )
+        order.name = "Here"
+        self.assertRaises(StaleDataError, order.update)
+        db.session.rollback()
+        self.assertEqual(Order.find(order.id).name, order.name)
+
+    def test_transition_orders(self):
+        """It should change the status of Orders that allow the action only"""
+        new = OrderFactory(status=OrderStatus.NEW)
+        new.create()
+        shipped = OrderFactory(status=OrderStatus.SHIPPED)
+        shipped.create()
+
+        rows = Order.transition([new.id, shipped.id, new.id + 1000], "cancel")
+        self.assertEqual([row.id for row in rows], [new.id])
+        self.assertEqual(rows[0].status, "CANCELED")
+        self.assertEqual(rows[0].version, 2)
+        self.assertEqual(Order.find(new.id).status, OrderStatus.CANCELED)
+        self.assertEqual(
+            Order.find_statuses([new.id, shipped.id, new.id + 1000]),
+            {new.id: "CANCELED", shipped.id: "SHIPPED"},
+        )
+        self.assertEqual(Order.transition([shipped.id], "deliver")[0].status, "DELIVERED")
+
+    def test_write_in_batches_past_unmatched_batch(self):
+        """It should go on to the next batch when a whole batch's write matches nothing"""
+        orders = []
+        for order_status in (OrderStatus.SHIPPED, OrderStatus.SHIPPED, OrderStatus.NEW, OrderStatus.NEW):
+            order = OrderFactory(status=order_status)
+            order.create()
+            orders.append(order)
+        # Stands in for a batch whose Orders left the status after they were picked
+        statement = (
+            update(Order.__table__)
+            .where(Order.status == OrderStatus.NEW)
+            .values(status=OrderStatus.CANCELED)
+        )
+        self.assertEqual(Order.write_in_batches(Order.query, statement, 2), 2)
+        self.assertEqual(
+            Order.find_statuses([order.id for order in orders]),
+            {orders[0].id: "SHIPPED", orders[1].id: "SHIPPED", orders[2].id: "CANCELED", orders[3].id: "CANCELED"},
+        )
+
+    def assert_summaries_match(self):
+        """Checks the summary tables against aggregates of the order table"""
+        for group_by in ((), ("status",), ("day",), ("week", "status")):
+            self.assertEqual(OrderDailySummary.stats(group_by), Order.stats(Order.query, group_by))
+        self.assertCountEqual(UserOrderSummary.stats(("user_id",)), Order.stats(Order.query, ("user_id",)))
+
+    def test_order_summaries(self):
+        """It should keep the summary tables in step with every Order write"""
+        orders = []
+        for user_id in (1000, 1000, 1001):
+            order = OrderFactory(user_id=user_id, status=OrderStatus.NEW)
+            order.create()
+            orders.append(order)
+        self.assert_summaries_match()
+        self.assertEqual(UserOrderSummary.stats((), 1000)[0]["count"], 2)
+
+        orders[0].cost_amount += 10
+        orders[0].create_time -= timedelta(days=3)
+        orders[0].update()
+        self.assert_summaries_match()
+        Order.transition([orders[1].id], "cancel")
+        self.assert_summaries_match()
+
+        # Item writes do not change the numbers, and do not touch the summaries
+        before = [(row.day, row.status, row.orders, row.revenue) for row in OrderDailySummary.query.all()]
+        Item.bulk_create(orders[2].id, [ItemFactory(order_id=orders[2].id) for _ in range(2)])
+        after = [(row.day, row.status, row.orders, row.revenue) for row in OrderDailySummary.query.all()]
+        self.assertCountEqual(after, before)
+
+        # A rolled back write rolls back its summary changes too
+        OrderFactory(user_id=1002).create(commit=False)
+        db.session.rollback()
+        self.assertEqual(UserOrderSummary.stats((), 1002)[0]["count"], 0)
+
+        Order.update_status_where(Order.query.filter(Order.user_id == 1000), OrderStatus.APPROVED, 1)
+        self.assert_summaries_match()
+        orders[2].delete()
+        self.assert_summaries_match()
+        Order.delete_where(Order.query, 10)
+        self.assertEqual(OrderDailySummary.stats(), [{"count": 0, "revenue": 0.0, "average": None}])
+        self.assertEqual(UserOrderSummary.stats(("user_id",)), [])
+
+        # Groups left with no Orders are deleted, not kept at zero
+        self.assertEqual(OrderDailySummary.query.count(), 0)
+        self.assertEqual(UserOrderSummary.query.count(), 0)
+
+    def test_summaries_created_over_orders(self):
+        """It should summarize the existing Orders when it creates the summary tables"""
+        for _ in range(3):
+            OrderFactory().create()
+        db.session.execute(text("DROP TABLE order_daily_summary, order_user_summary"))
+        db.session.commit()
+        db.create_all()
+        self.assert_summaries_match()
+
+    def test_upgrade_schema(self):
+        """It should add the version column and triggers to an older order table"""
+        order = OrderFactory(status=OrderStatus.NEW)
+        order.create()
+        db.session.execute(text('ALTER TABLE "order" DROP COLUMN version'))
+        db.session.execute(text('DROP TRIGGER order_version ON "order"'))
+        db.session.commit()
+        upgrade_schema()
+        upgrade_schema()  # and do nothing the second time
+        self.assertEqual(Order.find_version(order.id), 1)
+        Order.transition([order.id], "cancel")
+        self.assertEqual(Order.find_version(order.id), 2)
+        self.assertEqual(create_missing_indexes(), [])
+
+    def test_rebuild_summaries(self):
+        """It should recompute the summary tables from the order table"""
+        for _ in range(3):
+            OrderFactory().create()
+        db.session.query(OrderDailySummary).delete()
+        db.session.query(UserOrderSummary).delete()
+        db.session.commit()
+        days, users = rebuild_summaries()
+        self.assertEqual(days, len(OrderDailySummary.stats(("day", "status"))))
+        self.assertEqual(users, len(UserOrderSummary.stats(("user_id",))))
+        self.assert_summaries_match()
+
+    def test_idempotent_write(self):
+        """It should commit the response of a key with the writes, only once"""
+        with idempotent_write("key-1", b"hash", 60) as record:
+            order = OrderFactory()
+            order.create(commit=False)
+            record.status_code = 201
+            record.body = {"id": order.id}
+        found = IdempotencyKey.find("key-1")
+        self.assertEqual(found.entry()["body"], {"id": order.id})
+        self.assertEqual(found.request_hash, b"hash")
+
+        # A concurrent duplicate loses on the primary key and writes nothing
+        db.session.remove()  # like another worker, which has not loaded the key
+        with self.assertRaises(DuplicateRequestError):
+            with idempotent_write("key-1", b"hash", 60) as record:
+                OrderFactory().create(commit=False)
+                record.status_code = 201
+                record.body = {}
+        self.assertEqual(len(Order.all()), 1)
+
+    def test_idempotency_key_expiry(self):
+        """It should forget idempotency keys once they expire"""
+        db.session.query(IdempotencyKey).delete()
+        now = datetime.now(timezone.utc)
+        for key, expires_at in (("old", now - timedelta(seconds=1)), ("older", now), ("new", now + timedelta(hours=1))):
+            db.session.add(IdempotencyKey(key=key, request_hash=b"", status_code=201, body={}, expires_at=expires_at))
+        db.session.commit()
+
+        self.assertIsNone(IdempotencyKey.find("old"))
+        self.assertIsNone(IdempotencyKey.find("missing"))
+        self.assertEqual(IdempotencyKey.purge_expired(), 1)
+        self.assertEqual([record.key for record in IdempotencyKey.query.all()], ["new"])
@@ -6,13 +6,26 @@ Test cases can be run with the following:
  nosetests -v --with-spec --spec-color
  coverage report -m
 """
+# pylint: disable=too-many-lines
 import os
+import csv
+import io
+import gzip
+import json
 import logging
 from unittest import TestCase
 from datetime import datetime
+import brotli
+import msgpack
+import zstandard
+from flask import jsonify
 from service import app
-from service.models import OrderStatus, ItemStatus, Order, db, init_db
+from service.models import OrderStatus, ItemStatus, Order, Item, IdempotencyKey, db, init_db
 from service.common import status  # HTTP Status Codes
+from service.common.sql_stats import QueryCounter
+from service.common import metrics
+from service.common.cache import order_cache
+from service.common.idempotency import idempotency_cache
 from tests.factories import OrderFactory, ItemFactory
 
 
@@ -22,12 +35,19 @@ DATABASE_URI = os.getenv(
 
 
 BASE_URL = "/orders"
+MSGPACK = "application/msgpack"
+
+
+def jsonify_bytes(obj):
+    """Returns the body jsonify(obj) would send"""
+    with app.app_context():
+        return jsonify(obj).data
 
 
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
-class TestOrderService(TestCase):
+class TestOrderService(TestCase):  # pylint: disable=too-many-public-methods
     """Order Service Tests"""
 
     @classmethod
@@ -46,7 +66,10 @@ class TestOrderService(TestCase):
     def setUp(self):
         """Runs before each test"""
         db.session.query(Order).delete()  # clean up the last tests
+        db.session.query(IdempotencyKey).delete()
         db.session.commit()
+        order_cache.clear()
+        idempotency_cache.clear()
 
         self.client = app.test_client()
 
@@ -58,14 +81,12 @@ class TestOrderService(TestCase):
     #  H E L P E R   M E T H O D S
     ######################################################################
 
-    def _create_orders(self, count, user_id=None):
+    def _create_orders(self, count, user_id=None, order_status=None):
         """Factory method to create orders in bulk"""
         orders = []
         for _ in range(count):
-            if user_id:
-                order = OrderFactory(user_id=user_id)
-            else:
-                order = OrderFactory()
+            fields = {"user_id": user_id, "status": order_status}
+            order = OrderFactory(**{name: value for name, value in fields.items() if value})
             resp = self.client.post(BASE_URL, json=order.serialize())
             self.assertEqual(
                 resp.status_code,
@@ -257,6 +278,52 @@ class TestOrderService(TestCase):
             new_order["status"], order.status.name, "Status does not match"
         )
 
+    def test_create_order_non_finite_cost(self):
+        """It should not Create an Order whose cost_amount JSON cannot carry"""
+        data = OrderFactory().serialize()
+        data["cost_amount"] = float("nan")
+        resp = self.client.post(BASE_URL, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("finite", resp.get_json()["message"])
+
+    def test_create_order_idempotency_key(self):
+        """It should create an Order only once per Idempotency-Key"""
+        order = OrderFactory()
+        order.items = [ItemFactory(order=None)]
+        headers = {"Idempotency-Key": "c0ffee-1"}
+        resp = self.client.post(BASE_URL, json=order.serialize(), headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", resp.headers)
+        created = resp.get_json()
+
+        # A retry is answered from the hot cache without touching the database
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.post(BASE_URL, json=order.serialize(), headers=headers)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(resp.get_json(), created)
+        self.assertTrue(resp.headers["Location"].endswith(f"{BASE_URL}?order_id={created['id']}"))
+
+        # ... and by another worker from the idempotency_key table
+        idempotency_cache.clear()
+        resp = self.client.post(
+            BASE_URL, data=msgpack.packb(order.serialize()), content_type=MSGPACK, headers=headers
+        )
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)  # not the same body
+        resp = self.client.post(BASE_URL, json=order.serialize(), headers=headers)
+        self.assertEqual(resp.get_json(), created)
+        self.assertEqual(Order.query.count(), 1)
+
+        other = OrderFactory().serialize()
+        resp = self.client.post(BASE_URL, json=other, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.post(BASE_URL, json=other, headers={"Idempotency-Key": "k" * 256})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(BASE_URL, json=other, headers={"Idempotency-Key": "c0ffee-2"})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.query.count(), 2)
+
     def test_create_item_in_order(self):
         """It should create an item in an order"""
         # Create a test order and item
@@ -285,10 +352,11 @@ class TestOrderService(TestCase):
         self.assertEqual(data["price"], item.price)
 
         # test order not found
-        non_existent_order_id = -1  # An order ID that does not exist
+        non_existent_order_id = order.id + 1000  # An order ID that does not exist
 
         response = self.client.post(
             f"/orders/{non_existent_order_id}/items",
+            json=item.serialize(),
             content_type="application/json",
         )
 
@@ -502,6 +570,137 @@ class TestOrderService(TestCase):
         # Verify that the response is a 404 error.
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_order_status_transitions(self):
+        """It should approve, ship and deliver an Order, and refuse other changes"""
+        order = self._create_orders(1, order_status=OrderStatus.NEW)[0]
+        url = f"{BASE_URL}/{order.id}"
+        etag = self.client.get(url).headers["ETag"]
+
+        resp = self.client.put(f"{url}/ship")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("in status NEW", resp.get_json()["message"])
+
+        for action, new_status in (("approve", "APPROVED"), ("ship", "SHIPPED")):
+            resp = self.client.put(f"{url}/{action}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["status"], new_status)
+            self.assertEqual(resp.get_json()["items"], [])
+            self.assertNotEqual(resp.headers["ETag"], etag)
+            etag = resp.headers["ETag"]
+            self.assertEqual(self.client.get(url).get_json()["status"], new_status)
+
+        # A shipped Order can no longer be canceled
+        resp = self.client.put(f"{url}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.put(f"{url}/deliver")
+        self.assertEqual(resp.get_json()["status"], "DELIVERED")
+
+        resp = self.client.put(f"{BASE_URL}/0/approve")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.put(f"{url}/refund")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_transition_is_one_statement(self):
+        """It should check and change the status with a single UPDATE"""
+        order = self._create_orders(1, order_status=OrderStatus.PENDING)[0]
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.put(f"{BASE_URL}/{order.id}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        updates = [sql for sql in counter.statements if sql.lstrip().upper().startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("RETURNING", updates[0])
+
+    def test_cancel_orders_in_bulk(self):
+        """It should cancel many Orders with one request"""
+        new = self._create_orders(2, order_status=OrderStatus.NEW)
+        shipped = self._create_orders(1, order_status=OrderStatus.SHIPPED)[0]
+        ids = [new[0].id, shipped.id, 0, new[1].id, new[0].id]
+
+        resp = self.client.put(f"{BASE_URL}/cancel", json={"ids": ids})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            resp.get_json(),
+            {"canceled": [new[0].id, new[1].id], "conflict": [shipped.id], "not_found": [0]},
+        )
+        for order in new:
+            self.assertEqual(self.client.get(f"{BASE_URL}/{order.id}").get_json()["status"], "CANCELED")
+
+        # Canceling again is a conflict, not an error
+        resp = self.client.put(f"{BASE_URL}/cancel", json={"ids": [new[0].id]})
+        self.assertEqual(resp.get_json()["conflict"], [new[0].id])
+
+        for body in ([1, 2], {"ids": "1"}, {"ids": [1, "2"]}, {"ids": list(range(app.config["BULK_CHUNK_SIZE"] + 1))}):
+            resp = self.client.put(f"{BASE_URL}/cancel", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_orders_in_bulk(self):
+        """It should set the status of every Order that matches the filters"""
+        approved = self._create_orders(3, user_id=7, order_status=OrderStatus.APPROVED)
+        self._create_orders(2, user_id=7, order_status=OrderStatus.NEW)
+        other = self._create_orders(2, user_id=8, order_status=OrderStatus.APPROVED)
+        self.client.get(f"{BASE_URL}/{approved[0].id}")  # cache it
+
+        chunk_size = app.config["BULK_CHUNK_SIZE"]
+        app.config["BULK_CHUNK_SIZE"] = 2
+        try:
+            with QueryCounter(db.engine) as counter:
+                resp = self.client.patch(
+                    f"{BASE_URL}?status=APPROVED&user_id=7", json={"status": "SHIPPED"}
+                )
+        finally:
+            app.config["BULK_CHUNK_SIZE"] = chunk_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"updated": 3, "skipped": 0})
+        updates = [sql for sql in counter.statements if sql.lstrip().upper().startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)  # 2 + 1, the empty SELECT ends it
+
+        self.assertEqual(self.client.get(f"{BASE_URL}/{approved[0].id}").get_json()["status"], "SHIPPED")
+        resp = self.client.get(f"{BASE_URL}?user_id=7&status=SHIPPED")
+        self.assertEqual(sorted(order["id"] for order in resp.get_json()), [order.id for order in approved])
+        resp = self.client.get(f"{BASE_URL}?user_id=8&status=APPROVED")
+        self.assertEqual(len(resp.get_json()), len(other))
+
+        # Only the moves an action allows are made
+        resp = self.client.patch(f"{BASE_URL}?user_id=7", json={"status": "DELIVERED"})
+        self.assertEqual(resp.get_json(), {"updated": 3, "skipped": 2})
+        resp = self.client.patch(f"{BASE_URL}?ids={approved[0].id}", json={"status": "NEW"})
+        self.assertEqual(resp.get_json(), {"updated": 0, "skipped": 1})
+        self.assertEqual(self.client.get(f"{BASE_URL}/{approved[0].id}").get_json()["status"], "DELIVERED")
+
+        resp = self.client.patch(f"{BASE_URL}?user_id=7", json={"status": "LOST"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(f"{BASE_URL}?status=BOGUS", json={"status": "SHIPPED"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(BASE_URL, json={"status": "SHIPPED"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_orders_in_bulk(self):
+        """It should delete every Order that matches the filters, with its Items"""
+        orders = self._create_orders(4)
+        self._create_items_in_existing_order(orders[0].id, 2)
+        self.client.get(f"{BASE_URL}/{orders[0].id}")  # cache it
+
+        ids = f"{orders[0].id},{orders[1].id}&ids={orders[2].id}"
+        resp = self.client.delete(f"{BASE_URL}?ids={ids}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"deleted": 3})
+        self.assertEqual(self.client.get(f"{BASE_URL}/{orders[0].id}").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Item.query.filter(Item.order_id == orders[0].id).count(), 0)
+        self.assertEqual([order["id"] for order in self.client.get(BASE_URL).get_json()], [orders[3].id])
+
+        resp = self.client.delete(f"{BASE_URL}?user_id=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.delete(f"{BASE_URL}?order_id=1.5")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.client.delete(f"{BASE_URL}?ids={orders[0].id}")
+        self.assertEqual(resp.get_json(), {"deleted": 0})
+        resp = self.client.delete(f"{BASE_URL}?ids=1,two")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.delete(f"{BASE_URL}?limit=5")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 1)
+
     def test_update_item_by_id(self):
         """It should update an item to an order by item ID and amount"""
 
@@ -613,3 +812,959 @@ class TestOrderService(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.get_json()
         self.assertTrue(len(data) >= 2)  # Check that at least 2 orders are returned
+
+    def test_list_orders_paginated(self):
+        """It should page through all Orders with a keyset cursor"""
+        orders = self._create_orders(5)
+        seen = []
+        resp = self.client.get(BASE_URL, query_string="limit=2")
+        while True:
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertLessEqual(len(data), 2)
+            seen.extend(order["id"] for order in data)
+            link = resp.headers.get("Link")
+            if link is None:
+                self.assertIsNone(resp.headers.get("X-Next-Cursor"))
+                break
+            self.assertIn('rel="next"', link)
+            next_url = link[link.index("<") + 1:link.index(">")]
+            resp = self.client.get(next_url)
+
+        self.assertEqual(len(seen), 5)
+        self.assertCountEqual(seen, [order.id for order in orders])
+
+        # Newest Orders come first
+        resp = self.client.get(BASE_URL)
+        times = [
+            datetime.fromisoformat(order["create_time"]) for order in resp.get_json()
+        ]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_list_orders_bad_page_params(self):
+        """It should reject a bad limit or cursor"""
+        resp = self.client.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="limit=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # A limit over the maximum is capped rather than rejected
+        self._create_orders(3)
+        app.config["MAX_PAGE_SIZE"], max_page_size = 2, app.config["MAX_PAGE_SIZE"]
+        try:
+            resp = self.client.get(BASE_URL, query_string="limit=50")
+        finally:
+            app.config["MAX_PAGE_SIZE"] = max_page_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIsNotNone(resp.headers.get("Link"))
+
+    def test_list_orders_query_count(self):
+        """It should list Orders with items in a fixed number of queries"""
+        counts = []
+        for _ in range(2):
+            for order in self._create_orders(3):
+                self._create_items_in_existing_order(order.id, 2)
+            with QueryCounter(db.engine) as counter:
+                resp = self.client.get(BASE_URL)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertTrue(all(len(order["items"]) == 2 for order in resp.get_json()))
+            counts.append(counter.count)
+
+        # One SELECT for the page of orders and one for all of their items
+        self.assertEqual(counts, [2, 2])
+
+    def test_read_an_order_query_count(self):
+        """It should read an Order and its items with a single query"""
+        order = self._create_orders(1)[0]
+        self._create_items_in_existing_order(order.id, 3)
+
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+        self.assertEqual(counter.count, 1)
+
+        order_cache.clear()
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertEqual(counter.count, 1)
+
+    def test_stream_orders_ndjson(self):
+        """It should stream every matching Order as NDJSON"""
+        orders = self._create_orders(5, user_id=1000)
+        for order in orders:
+            self._create_items_in_existing_order(order.id, 2)
+        self._create_orders(2, user_id=1001)
+
+        app.config["STREAM_BATCH_SIZE"], batch_size = 2, app.config["STREAM_BATCH_SIZE"]
+        try:
+            resp = self.client.get(
+                BASE_URL,
+                query_string="user_id=1000&limit=1",
+                headers={"Accept": "application/x-ndjson"},
+            )
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = batch_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertIn("Accept", resp.headers.get("Vary"))
+
+        lines = resp.get_data(as_text=True).splitlines()
+        data = [json.loads(line) for line in lines]
+        self.assertCountEqual([order["id"] for order in data], [order.id for order in orders])
+        self.assertTrue(all(len(order["items"]) == 2 for order in data))
+
+        # A cursor resumes the export after a given Order
+        resp = self.client.get(BASE_URL, query_string="user_id=1000&limit=2")
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get(
+            BASE_URL,
+            query_string={"user_id": 1000, "cursor": cursor},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        resumed = [json.loads(line)["id"] for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(resumed, [order["id"] for order in data[2:]])
+
+    def test_export_orders_csv(self):
+        """It should stream Orders as CSV with one row per Item"""
+        orders = self._create_orders(3, user_id=1000)
+        for order in orders[:2]:
+            self._create_items_in_existing_order(order.id, 2)
+        self._create_orders(1, user_id=1001)
+
+        app.config["STREAM_BATCH_SIZE"], batch_size = 2, app.config["STREAM_BATCH_SIZE"]
+        try:
+            resp = self.client.get(BASE_URL, query_string="user_id=1000", headers={"Accept": "text/csv"})
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = batch_size
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(rows[0]), ["id", "name", "create_time", "address", "cost_amount",
+                                         "status", "user_id", "item_id", "title", "amount",
+                                         "price", "product_id", "item_status"])
+        by_order = {}
+        for row in rows:
+            by_order.setdefault(int(row["id"]), []).append(row["item_id"])
+        self.assertEqual(sorted(by_order), sorted(order.id for order in orders))
+        self.assertEqual(by_order[orders[2].id], [""])
+        self.assertTrue(all(len(by_order[order.id]) == 2 for order in orders[:2]))
+        addresses = {int(row["id"]): row["address"] for row in rows}
+        self.assertEqual(addresses, {order.id: order.address for order in orders})
+
+        # Without Items there is one row per Order
+        resp = self.client.get(
+            BASE_URL, query_string="user_id=1000&fields=id,status", headers={"Accept": "text/csv"}
+        )
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], "id,status")
+        self.assertEqual(len(lines), 4)
+
+        # An empty export still has its header
+        resp = self.client.get(
+            BASE_URL, query_string="user_id=1&fields=id,status", headers={"Accept": "text/csv"}
+        )
+        self.assertEqual(resp.get_data(as_text=True).splitlines(), ["id,status"])
+
+    def test_filter_orders_by_create_time(self):
+        """It should filter Orders by a range of create times"""
+        times = ["2023-12-31T23:00:00+00:00", "2024-01-01T00:00:00+00:00", "2024-01-15T12:00:00+00:00",
+                 "2024-02-01T00:00:00+00:00"]
+        for create_time in times:
+            order = OrderFactory(user_id=1000).serialize()
+            order["create_time"] = create_time
+            resp = self.client.post(BASE_URL, json=order)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get(BASE_URL, query_string="created_after=2024-01-01&created_before=2024-02-01")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertCountEqual([order["create_time"] for order in resp.get_json()], times[1:3])
+        resp = self.client.get(BASE_URL, query_string="created_after=2024-01-01T01:00:00%2B01:00")
+        self.assertEqual(len(resp.get_json()), 3)
+        resp = self.client.get(BASE_URL, query_string="created_before=yesterday")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_stats(self):
+        """It should count and sum Orders in groups with one GROUP BY"""
+        rows = [
+            ("NEW", 1000, 10.0, "2024-01-01T08:00:00+00:00"),
+            ("NEW", 1000, 20.0, "2024-01-02T08:00:00+00:00"),
+            ("CANCELED", 1001, 30.5, "2024-01-02T23:30:00-05:00"),
+            ("APPROVED", 1001, 40.0, "2024-01-09T08:00:00+00:00"),
+        ]
+        for order_status, user_id, cost_amount, create_time in rows:
+            order = OrderFactory(status=OrderStatus[order_status], user_id=user_id).serialize()
+            order.update(cost_amount=cost_amount, create_time=create_time)
+            self.assertEqual(self.client.post(BASE_URL, json=order).status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [{"count": 4, "revenue": 100.5, "average": 25.12}])
+
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(f"{BASE_URL}/stats", query_string="group_by=status")
+        self.assertEqual(counter.count, 1)
+        self.assertIn("GROUP BY", counter.statements[0])
+        self.assertEqual(
+            [(group["status"], group["count"], group["revenue"]) for group in resp.get_json()],
+            [("NEW", 2, 30.0), ("APPROVED", 1, 40.0), ("CANCELED", 1, 30.5)],
+        )
+
+        # Days are in UTC, weeks start on Monday
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="group_by=day")
+        self.assertEqual(
+            [(group["day"], group["count"]) for group in resp.get_json()],
+            [("2024-01-01", 1), ("2024-01-02", 1), ("2024-01-03", 1), ("2024-01-09", 1)],
+        )
+        resp = self.client.get(
+            f"{BASE_URL}/stats", query_string="group_by=week,status&created_before=2024-01-09"
+        )
+        self.assertEqual(
+            [(group["week"], group["status"], group["count"]) for group in resp.get_json()],
+            [("2024-01-01", "NEW", 2), ("2024-01-01", "CANCELED", 1)],
+        )
+
+        # The users with the most revenue come first
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="group_by=user_id&limit=1")
+        self.assertEqual(resp.get_json(), [{"user_id": 1001, "count": 2, "revenue": 70.5, "average": 35.25}])
+
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="group_by=month")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_stats_from_summaries(self):
+        """It should read Order stats from the summary tables when they can tell"""
+        for order in self._create_orders(6):
+            if order.id % 2:
+                self.client.put(f"{BASE_URL}/{order.id}/cancel")
+        queries = {
+            "group_by=status": "order_daily_summary",
+            "group_by=week,status&created_after=2010-01-01&created_before=2020-01-01": "order_daily_summary",
+            "group_by=user_id&limit=3": "order_user_summary",
+            "user_id=1000": "order_user_summary",
+            "group_by=day&created_after=2010-01-01T12:00:00": 'FROM "order"',
+            "group_by=status&name=nobody": 'FROM "order"',
+            "group_by=status&user_id=1000": 'FROM "order"',
+        }
+        for query_string, table in queries.items():
+            with QueryCounter(db.engine) as counter:
+                resp = self.client.get(f"{BASE_URL}/stats", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertIn(table, counter.statements[-1], query_string)
+
+            app.config["STATS_FROM_SUMMARIES"] = False
+            try:
+                with QueryCounter(db.engine) as counter:
+                    expected = self.client.get(f"{BASE_URL}/stats", query_string=query_string)
+            finally:
+                app.config["STATS_FROM_SUMMARIES"] = True
+            self.assertIn('FROM "order"', counter.statements[-1])
+            self.assertEqual(resp.get_json(), expected.get_json(), query_string)
+
+        # An unknown status is refused whichever table would answer
+        for query_string in ("status=BOGUS", "group_by=user_id&status=BOGUS"):
+            resp = self.client.get(f"{BASE_URL}/stats", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+            self.assertIn("status must be one of", resp.get_json()["message"])
+
+    def test_create_orders_in_bulk(self):
+        """It should Create many Orders from a JSON array and report each row"""
+        orders = [OrderFactory().serialize() for _ in range(3)]
+        orders[1]["items"] = [ItemFactory().serialize() for _ in range(2)]
+        orders.insert(2, {"name": "no address"})
+
+        resp = self.client.post(f"{BASE_URL}/bulk", json=orders)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+        self.assertEqual(
+            [result["status"] for result in results],
+            [status.HTTP_201_CREATED, status.HTTP_201_CREATED,
+             status.HTTP_400_BAD_REQUEST, status.HTTP_201_CREATED],
+        )
+        self.assertIn("missing", results[2]["error"])
+
+        resp = self.client.get(results[1]["location"])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 2)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+        # Rows the database would refuse are 400s, not a failed chunk
+        orders = [OrderFactory().serialize() for _ in range(4)]
+        orders[1]["address"] = None
+        orders[2]["cost_amount"] = "abc"
+        orders[3]["user_id"] = 2**40
+        resp = self.client.post(f"{BASE_URL}/bulk", json=orders)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result["status"] for result in resp.get_json()],
+            [status.HTTP_201_CREATED] + [status.HTTP_400_BAD_REQUEST] * 3,
+        )
+        self.assertIn("address", resp.get_json()[1]["error"])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 4)
+
+        # Everything created is a plain 201
+        resp = self.client.post(f"{BASE_URL}/bulk", json=[OrderFactory().serialize()])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        # The body must be an array
+        resp = self.client.post(f"{BASE_URL}/bulk", json={"orders": []})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/bulk", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_create_orders_in_bulk_ndjson(self):
+        """It should Create many Orders from an NDJSON stream in chunks"""
+        lines = [json.dumps(OrderFactory().serialize()) for _ in range(5)]
+        lines.insert(3, "{not json")
+        lines.insert(1, "")
+        body = "\n".join(lines) + "\n"
+
+        app.config["BULK_CHUNK_SIZE"], chunk_size = 2, app.config["BULK_CHUNK_SIZE"]
+        try:
+            resp = self.client.post(
+                f"{BASE_URL}/bulk", data=body, content_type="application/x-ndjson"
+            )
+        finally:
+            app.config["BULK_CHUNK_SIZE"] = chunk_size
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual(len(results), 6)
+        rejected = [result for result in results if result["status"] != status.HTTP_201_CREATED]
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual(rejected[0]["line"], 5)
+        self.assertIn("Invalid JSON", rejected[0]["error"])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 5)
+
+    def test_import_orders_csv(self):
+        """It should Import Orders from CSV and report the rejected rows"""
+        columns = ["name", "create_time", "address", "cost_amount", "status", "user_id", "items"]
+        rows = []
+        for _ in range(4):
+            order = OrderFactory().serialize()
+            order["items"] = json.dumps([ItemFactory().serialize() for _ in range(2)])
+            rows.append(order)
+        rows[1]["items"] = "[not json"
+        rows[2]["name"] = "x" * 100
+        body = io.StringIO()
+        writer = csv.DictWriter(body, columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+        app.config["IMPORT_CHUNK_SIZE"], chunk_size = 2, app.config["IMPORT_CHUNK_SIZE"]
+        try:
+            resp = self.client.post(f"{BASE_URL}/import", data=body.getvalue(), content_type="text/csv")
+        finally:
+            app.config["IMPORT_CHUNK_SIZE"] = chunk_size
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual((data["imported"], data["items"], data["rejected"]), (2, 4, 2))
+        # The addresses span two lines, so row n starts on line 2n
+        self.assertEqual([error["line"] for error in data["errors"]], [4, 6])
+        self.assertIn("Invalid items", data["errors"][0]["error"])
+        self.assertIn("name", data["errors"][1]["error"])
+
+        orders = self.client.get(BASE_URL).get_json()
+        self.assertCountEqual([order["name"] for order in orders], [rows[0]["name"], rows[3]["name"]])
+        self.assertTrue(all(len(order["items"]) == 2 for order in orders))
+
+    def test_import_orders_ndjson(self):
+        """It should Import Orders from NDJSON"""
+        lines = [json.dumps(OrderFactory().serialize()) for _ in range(3)]
+        lines.insert(1, "{not json")
+        # Values COPY would refuse are rejected up front, with their line
+        for name, value in (("user_id", 99999999999), ("address", "1 Main St\x00")):
+            order = OrderFactory().serialize()
+            order[name] = value
+            lines.append(json.dumps(order))
+        app.config["IMPORT_CHUNK_SIZE"], chunk_size = 2, app.config["IMPORT_CHUNK_SIZE"]
+        try:
+            resp = self.client.post(
+                f"{BASE_URL}/import", data="\n".join(lines) + "\n", content_type="application/x-ndjson"
+            )
+        finally:
+            app.config["IMPORT_CHUNK_SIZE"] = chunk_size
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual((data["imported"], data["rejected"]), (3, 3))
+        self.assertEqual([error["line"] for error in data["errors"]], [2, 5, 6])
+        self.assertIn("user_id", data["errors"][1]["error"])
+        self.assertIn("NUL", data["errors"][2]["error"])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+        resp = self.client.post(
+            f"{BASE_URL}/import", data=lines[0], content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.post(f"{BASE_URL}/import", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_create_item_in_order_query_count(self):
+        """It should create an item with a single INSERT and no Order lookup"""
+        order = self._create_orders(1)[0]
+        item = ItemFactory()
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        inserts = [sql for sql in counter.statements if sql.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(any('FROM "order"' in sql for sql in counter.statements))
+        self.assertFalse(any(sql.startswith("UPDATE") for sql in counter.statements))
+
+    def test_create_items_in_bulk(self):
+        """It should create many items in an order at once"""
+        order = self._create_orders(1)[0]
+        items = [ItemFactory(amount=3).serialize() for _ in range(4)]
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.post(f"{BASE_URL}/{order.id}/items/bulk", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(counter.count, 1)
+        data = resp.get_json()
+        self.assertEqual(len(data), 4)
+        self.assertTrue(all(item["order_id"] == order.id for item in data))
+        self.assertTrue(all(item["amount"] == 3 for item in data))
+        self.assertCountEqual(
+            [item["title"] for item in data], [item["title"] for item in items]
+        )
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(len(resp.get_json()), 4)
+
+        # One bad item rejects the whole batch
+        items[2].pop("title")
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items/bulk", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Item 2", resp.get_json()["message"])
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(len(resp.get_json()), 4)
+
+        # The foreign key reports a missing order
+        items.pop(2)
+        resp = self.client.post(f"{BASE_URL}/{order.id + 1000}/items/bulk", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items/bulk", json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/{order.id + 1000}/items/bulk", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items/bulk", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json(), [])
+
+        # Values that do not fit their columns are refused before the INSERT
+        items[1]["amount"] = 2**40
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items/bulk", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Item 1", resp.get_json()["message"])
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(len(resp.get_json()), 4)
+
+    def test_item_lookup_is_keyed(self):
+        """It should read and delete one item without loading its order"""
+        order = self._create_orders(1)[0]
+        items = self._create_items_in_existing_order(order.id, 5)
+        other = self._create_orders(1)[0]
+
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(f"{BASE_URL}/{order.id}/items/{items[2].id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], items[2].id)
+        self.assertEqual(counter.count, 1)
+
+        # An item is only found through its own order
+        resp = self.client.get(f"{BASE_URL}/{other.id}/items/{items[2].id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(f"{BASE_URL}/{other.id + 1000}/items/{items[2].id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.delete(f"{BASE_URL}/{other.id}/items/{items[2].id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.delete(f"{BASE_URL}/{order.id}/items/{items[2].id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(counter.count, 1)
+        self.assertTrue(counter.statements[0].startswith("DELETE FROM item"))
+
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(len(resp.get_json()), 4)
+
+    def test_read_an_order_is_cached(self):
+        """It should serve repeat reads of an Order from the cache"""
+        order = self._create_orders(1)[0]
+        self._create_items_in_existing_order(order.id, 2)
+        before = self.client.get("/diagnostics/cache").get_json()
+
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with QueryCounter(db.engine) as counter:
+            cached = self.client.get(f"{BASE_URL}/{order.id}")
+            items = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(cached.get_json(), resp.get_json())
+        self.assertEqual(items.get_json(), resp.get_json()["items"])
+
+        stats = self.client.get("/diagnostics/cache").get_json()
+        self.assertEqual(stats["backend"], "lru")
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertEqual(stats["hits"] - before["hits"], 2)
+
+    def test_writes_invalidate_the_cache(self):
+        """It should drop a cached Order whenever it or its items change"""
+        order = self._create_orders(1, order_status=OrderStatus.NEW)[0]
+        url = f"{BASE_URL}/{order.id}"
+
+        def read():
+            return self.client.get(url).get_json()
+
+        read()
+        self.client.put(url, json={"name": "Renamed"})
+        self.assertEqual(read()["name"], "Renamed")
+
+        item = self._create_items_in_existing_order(order.id, 1)[0]
+        self.assertEqual(len(read()["items"]), 1)
+
+        self.client.put(f"{url}/items/{item.id}", json={"title": "Renamed"})
+        self.assertEqual(read()["items"][0]["title"], "Renamed")
+
+        self.client.post(f"{url}/items/bulk", json=[ItemFactory().serialize()])
+        self.assertEqual(len(read()["items"]), 2)
+
+        self.client.delete(f"{url}/items/{item.id}")
+        self.assertEqual(len(read()["items"]), 1)
+
+        self.client.put(f"{url}/cancel")
+        self.assertEqual(read()["status"], "CANCELED")
+
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_etag(self):
+        """It should send an ETag that changes with the Order and its items"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}"
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        self.assertEqual(self.client.get(f"{url}/items").headers["ETag"], etag)
+
+        # Still current: 304 with no body, and nothing serialized
+        for cached in (True, False):
+            if not cached:
+                order_cache.clear()
+            with QueryCounter(db.engine) as counter:
+                resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(resp.data, b"")
+            self.assertEqual(resp.headers["ETag"], etag)
+            self.assertEqual(counter.count, 0 if cached else 1)
+        resp = self.client.get(f"{url}/items", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Any write to the Order or its items gives a new ETag
+        etags = [etag]
+        self._create_items_in_existing_order(order.id, 1)
+        etags.append(self.client.get(url).headers["ETag"])
+        self.client.post(f"{url}/items/bulk", json=[ItemFactory().serialize() for _ in range(3)])
+        etags.append(self.client.get(url).headers["ETag"])
+        resp = self.client.put(url, json={"name": "Renamed"})
+        etags.append(resp.headers["ETag"])
+        self.assertEqual(self.client.get(url).headers["ETag"], etags[-1])
+        self.assertEqual(len(set(etags)), 4)
+
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{order.id + 1000}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_update_an_order_if_match(self):
+        """It should only update an Order whose ETag still matches If-Match"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}"
+        etag = self.client.get(url).headers["ETag"]
+
+        resp = self.client.put(url, json={"name": "First"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # A second writer holding the old ETag loses
+        resp = self.client.put(url, json={"name": "Second"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["name"], "First")
+
+        resp = self.client.put(url, json={"name": "Any"}, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_metrics(self):
+        """It should count and time requests per route and status code"""
+        order = self._create_orders(1)[0]
+        registry = metrics.REGISTRY
+        labels = {"method": "GET", "route": "/orders/<int:order_id>", "status": "200"}
+        before = registry.get_sample_value("http_requests_total", labels) or 0
+        checkouts = registry.get_sample_value("db_pool_checkout_wait_seconds_count")
+        db.session.commit()  # hand the connection back to the pool
+        order_cache.clear()
+        self.client.get(f"{BASE_URL}/{order.id}")
+        self.client.get(f"{BASE_URL}/{order.id}")
+        self.client.get(f"{BASE_URL}/{order.id + 1000}")
+
+        self.assertEqual(registry.get_sample_value("http_requests_total", labels), before + 2)
+        self.assertGreaterEqual(
+            registry.get_sample_value("http_request_duration_seconds_count", labels), 2
+        )
+        self.assertGreater(registry.get_sample_value("db_pool_checkout_wait_seconds_count"), checkouts)
+        self.assertGreater(
+            registry.get_sample_value("db_request_sql_seconds_sum", {"route": "/orders/<int:order_id>"}), 0
+        )
+        self.assertGreaterEqual(
+            registry.get_sample_value("db_request_pool_wait_seconds_count", {"route": "/orders/<int:order_id>"}), 3
+        )
+        self.assertEqual(
+            registry.get_sample_value(
+                "http_requests_in_progress", {"method": "GET", "route": "/orders/<int:order_id>"}
+            ),
+            0,
+        )
+
+        self.client.get("/no/such/url")
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn('http_requests_total{method="GET",route="/orders/<int:order_id>",status="404"}', body)
+        self.assertIn("http_request_duration_seconds_bucket", body)
+        self.assertIn('route="<unmatched>",status="404"', body)
+
+    def test_server_timing(self):
+        """It should report the SQL count and time of a request in Server-Timing"""
+        order = self._create_orders(1)[0]
+        order_cache.clear()
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        timings = {timing.split(";")[0]: timing for timing in resp.headers.getlist("Server-Timing")}
+        self.assertCountEqual(timings, ["db", "pool"])
+        self.assertIn(f'desc="{counter.count} statements"', timings["db"])
+        self.assertRegex(timings["pool"], r"^pool;dur=\d+\.\d{3}$")
+
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertIn('db;dur=0.000;desc="0 statements"', resp.headers.getlist("Server-Timing"))
+
+    def test_slow_query_log(self):
+        """It should log statements that cross the slow query threshold"""
+        order = self._create_orders(1)[0]
+        order_cache.clear()
+        threshold = app.config["SLOW_QUERY_THRESHOLD_MS"]
+        app.config["SLOW_QUERY_THRESHOLD_MS"] = 0
+        try:
+            with self.assertLogs("flask.app", level="WARNING") as logs:
+                self.client.get(f"{BASE_URL}/{order.id}")
+        finally:
+            app.config["SLOW_QUERY_THRESHOLD_MS"] = threshold
+        entry = json.loads(logs.records[0].getMessage().split(": ", 1)[1])
+        self.assertEqual(entry["event"], "slow_query")
+        self.assertEqual(entry["route"], "/orders/<int:order_id>")
+        self.assertEqual(entry["method"], "GET")
+        self.assertGreaterEqual(entry["duration_ms"], 0)
+        self.assertNotIn(str(order.id), entry["statement"])
+        self.assertEqual(len(entry["fingerprint"]), 16)
+
+    def test_pool_stats(self):
+        """It should report the settings and usage of the connection pool"""
+        resp = self.client.get("/diagnostics/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["pool"], "QueuePool")
+        self.assertEqual(data["size"], app.config["DB_POOL_SIZE"])
+        self.assertEqual(data["pre_ping"], app.config["DB_POOL_PRE_PING"])
+        self.assertGreaterEqual(data["checked_out"], 0)
+
+    def test_list_orders_matches_jsonify(self):
+        """It should list Orders with the same bytes as jsonify(Order.serialize())"""
+        orders = self._create_orders(3)
+        self._create_items_in_existing_order(orders[0].id, 2)
+        self._create_items_in_existing_order(orders[2].id, 1)
+        order = Order.find(orders[1].id)
+        order.name = "Apt 1e5"
+        order.cost_amount = 0.00001
+        order.update()
+
+        db.session.expire_all()
+        expected = Order.keyset_page(Order.with_items(), 10)
+        expected = jsonify_bytes([order.serialize() for order in expected])
+        resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.content_type, "application/json")
+        self.assertEqual(resp.data, expected)
+
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        lines = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(jsonify_bytes(lines), expected)
+
+    def test_list_orders_sparse_fields(self):
+        """It should list only the requested fields of Orders"""
+        orders = self._create_orders(2)
+        self._create_items_in_existing_order(orders[0].id, 2)
+
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(BASE_URL, query_string={"fields": "status,cost_amount"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        for order in data:
+            self.assertEqual(sorted(order), ["cost_amount", "id", "status"])
+        self.assertEqual(counter.count, 1)
+        statement = counter.statements[0]
+        self.assertNotIn("address", statement)
+        self.assertNotIn("FROM item", statement)
+
+        resp = self.client.get(BASE_URL, query_string={"fields": "name", "include": "items"})
+        data = {order["id"]: order for order in resp.get_json()}
+        self.assertEqual(sorted(data[orders[0].id]), ["id", "items", "name"])
+        self.assertEqual(len(data[orders[0].id]["items"]), 2)
+        self.assertEqual(data[orders[1].id]["items"], [])
+
+        resp = self.client.get(
+            BASE_URL,
+            query_string={"fields": "id,status", "limit": 1},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        lines = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([sorted(order) for order in lines], [["id", "status"]] * 2)
+
+        resp = self.client.get(BASE_URL, query_string={"fields": "status", "limit": 1})
+        self.assertIn("fields=status", resp.headers["Link"])
+
+        # Repeated parameters carry over to the next page
+        resp = self.client.get(BASE_URL, query_string=[("limit", 1), ("fields", "id"), ("fields", "status")])
+        next_url = resp.headers["Link"].split(">", 1)[0].lstrip("<")
+        self.assertIn("fields=id&fields=status", next_url)
+        resp = self.client.get(next_url)
+        self.assertEqual([sorted(order) for order in resp.get_json()], [["id", "status"]])
+
+    def test_read_an_order_sparse_fields(self):
+        """It should read only the requested fields of an Order"""
+        order = self._create_orders(1)[0]
+        self._create_items_in_existing_order(order.id, 2)
+        url = f"{BASE_URL}/{order.id}"
+        etag = self.client.get(url).headers["ETag"]
+        full = self.client.get(url).get_json()
+
+        for cached in (False, True):
+            order_cache.clear()
+            if cached:
+                self.client.get(url)  # only whole Orders are cached
+            with QueryCounter(db.engine) as counter:
+                resp = self.client.get(url, query_string={"fields": "id,status,cost_amount"})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                resp.get_json(), {key: full[key] for key in ("id", "status", "cost_amount")}
+            )
+            self.assertEqual(resp.headers["ETag"], etag)
+            self.assertEqual(counter.count, 0 if cached else 1)
+            if not cached:
+                self.assertNotIn("FROM item", counter.statements[0])
+                self.assertNotIn("address", counter.statements[0])
+
+            resp = self.client.get(url, query_string={"fields": "create_time", "include": "items"})
+            self.assertEqual(
+                resp.get_json(),
+                {"id": order.id, "create_time": full["create_time"], "items": full["items"]},
+            )
+
+        # A current copy is confirmed from the version alone
+        order_cache.clear()
+        with QueryCounter(db.engine) as counter:
+            resp = self.client.get(
+                url, query_string={"fields": "status", "include": "items"}, headers={"If-None-Match": etag}
+            )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(counter.count, 1)
+        self.assertNotIn("FROM item", counter.statements[0])
+        resp = self.client.get(f"{BASE_URL}/{order.id + 1000}", query_string={"fields": "status"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sparse_fields_bad_params(self):
+        """It should reject unknown fields and includes"""
+        order = self._create_orders(1)[0]
+        for url in (BASE_URL, f"{BASE_URL}/{order.id}"):
+            resp = self.client.get(url, query_string={"fields": "id,secret"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("secret", resp.get_json()["message"])
+            resp = self.client.get(url, query_string={"include": "customer"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compression(self):
+        """It should compress large responses with the best accepted coding"""
+        orders = self._create_orders(10)
+        for order in orders[:3]:
+            self._create_items_in_existing_order(order.id, 2)
+        plain = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        self.assertGreater(len(plain.data), app.config["COMPRESS_MIN_SIZE"])
+
+        decoders = {
+            "gzip": gzip.decompress,
+            "br": brotli.decompress,
+            "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        }
+        for accept, coding in (
+            ("gzip", "gzip"),
+            ("gzip, br", "br"),
+            ("gzip, br, zstd", "zstd"),
+            ("br;q=0.5, gzip", "gzip"),
+        ):
+            resp = self.client.get(BASE_URL, headers={"Accept-Encoding": accept})
+            self.assertEqual(resp.headers["Content-Encoding"], coding)
+            self.assertIn("Accept", resp.headers["Vary"])
+            self.assertIn("Accept-Encoding", resp.headers["Vary"])
+            self.assertLess(len(resp.data), len(plain.data))
+            self.assertEqual(decoders[coding](resp.data), plain.data)
+
+        for accept in ("identity", "gzip;q=0", "compress"):
+            resp = self.client.get(BASE_URL, headers={"Accept-Encoding": accept})
+            self.assertNotIn("Content-Encoding", resp.headers)
+
+        # Small bodies and 304s are sent as they are
+        url = f"{BASE_URL}/{orders[-1].id}"
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        resp = self.client.get(
+            url, headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compression_etag(self):
+        """It should give each coding of an Order its own ETag"""
+        order = self._create_orders(1)[0]
+        self._create_items_in_existing_order(order.id, 20)
+        url = f"{BASE_URL}/{order.id}"
+        plain = self.client.get(url)
+        etag = plain.headers["ETag"]
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["ETag"], f'{etag[:-1]}-gzip"')
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+
+        # Either tag revalidates, and the 304 names the one the client holds
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": f'{etag[:-1]}-gzip"'})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], f'{etag[:-1]}-gzip"')
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        resp = self.client.put(url, json={"name": "Gzip"}, headers={"If-Match": f'{etag[:-1]}-gzip"'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.put(url, json={"name": "Stale"}, headers={"If-Match": f'{etag[:-1]}-gzip"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_compression_stream(self):
+        """It should compress a streamed NDJSON export as it is sent"""
+        self._create_orders(5)
+        plain = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        resp = self.client.get(
+            BASE_URL, headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}
+        )
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+    def test_msgpack(self):
+        """It should read and write application/msgpack bodies"""
+        order = OrderFactory()
+        resp = self.client.post(
+            BASE_URL,
+            data=msgpack.packb(order.serialize()),
+            content_type=MSGPACK,
+            headers={"Accept": MSGPACK},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.content_type, MSGPACK)
+        self.assertIn("Accept", resp.headers["Vary"])
+        created = msgpack.unpackb(resp.data)
+        self.assertEqual(created["name"], order.name)
+
+        items = [ItemFactory().serialize() for _ in range(2)]
+        resp = self.client.post(
+            f"{BASE_URL}/{created['id']}/items/bulk",
+            data=msgpack.packb(items),
+            content_type=MSGPACK,
+            headers={"Accept": MSGPACK},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(msgpack.unpackb(resp.data)), 2)
+
+        json_body = self.client.get(f"{BASE_URL}/{created['id']}").get_json()
+        for url in (f"{BASE_URL}/{created['id']}", BASE_URL):
+            resp = self.client.get(url, headers={"Accept": MSGPACK})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.content_type, MSGPACK)
+            data = msgpack.unpackb(resp.data)
+            self.assertEqual(data if isinstance(data, dict) else data[0], json_body)
+
+        # JSON stays the default
+        resp = self.client.get(BASE_URL, headers={"Accept": "*/*"})
+        self.assertEqual(resp.content_type, "application/json")
+
+    def test_msgpack_etag(self):
+        """It should give the JSON and MessagePack representations their own ETags"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}"
+        etag = self.client.get(url).headers["ETag"]
+        resp = self.client.get(url, headers={"Accept": MSGPACK})
+        packed = resp.headers["ETag"]
+        self.assertEqual(packed, f'{etag[:-1]}-msgpack"')
+        self.assertIn("Accept", resp.headers["Vary"])
+
+        # Each tag only revalidates its own representation
+        resp = self.client.get(url, headers={"Accept": MSGPACK, "If-None-Match": packed})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], packed)
+        self.assertIn("Accept", resp.headers["Vary"])
+        resp = self.client.get(url, headers={"If-None-Match": packed})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(url, headers={"Accept": MSGPACK, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # but either names the version a write is conditional on
+        resp = self.client.put(url, json={"name": "Packed"}, headers={"If-Match": packed})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.put(url, json={"name": "Stale"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_msgpack_bad_body(self):
+        """It should reject bodies that are not valid MessagePack"""
+        resp = self.client.post(BASE_URL, data=b"\xc1", content_type=MSGPACK)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("MessagePack", resp.get_json()["message"])
+
+        resp = self.client.post(BASE_URL, data=b"<order/>", content_type="application/xml")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertIn(MSGPACK, resp.get_json()["message"])
+
+    def test_msgpack_errors(self):
+        """It should write error bodies in the media type the client accepts"""
+        resp = self.client.get(f"{BASE_URL}/0", headers={"Accept": MSGPACK})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(resp.content_type, MSGPACK)
+        self.assertIn("Accept", resp.headers["Vary"])
+        error = msgpack.unpackb(resp.data)
+        self.assertEqual(error["status"], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(error["error"], "Not Found")
+
+        resp = self.client.post(BASE_URL, data=b"\xc1", content_type=MSGPACK, headers={"Accept": MSGPACK})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("MessagePack", msgpack.unpackb(resp.data)["message"])
+
+        resp = self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(resp.content_type, "application/json")
+        self.assertEqual(resp.get_json()["error"], "Not Found")
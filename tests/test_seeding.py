@@ -0,0 +1,37 @@
+"""
+Test cases for the synthetic data generator
+
+"""
+import random
+from unittest import TestCase
+from service.common.seeding import batches, generate_rows
+from service.models import ItemStatus, OrderStatus
+
+
+######################################################################
+#  S E E D I N G   T E S T   C A S E S
+######################################################################
+class TestSeeding(TestCase):
+    """Test Cases for the synthetic data generator"""
+
+    def test_generate_rows(self):
+        """It should generate Orders with their Items in factory ranges"""
+        orders, items = generate_rows(random.Random(1), [10, 11, 12], 2, 1.7e9)
+        self.assertEqual([order[0] for order in orders], [10, 11, 12])
+        self.assertEqual(sorted(item[0] for item in items), [10, 10, 11, 11, 12, 12])
+        for _, _, create_time, address, cost, order_status, user_id in orders:
+            self.assertTrue(create_time.startswith("20"))
+            self.assertIn("\n", address)
+            self.assertTrue(1 <= cost <= 1000)
+            self.assertIn(order_status, OrderStatus.__members__)
+            self.assertTrue(1000 <= user_id <= 9999)
+        for item in items:
+            self.assertIn(item[5], ItemStatus.__members__)
+        self.assertEqual(generate_rows(random.Random(1), [10], 1, 1.7e9), generate_rows(random.Random(1), [10], 1, 1.7e9))
+
+    def test_batches(self):
+        """It should split the orders into batches with their own seeds"""
+        tasks = list(batches("postgresql://", 25, 3, 10, "copy", 1))
+        self.assertEqual([task[1] for task in tasks], [10, 10, 5])
+        self.assertEqual(len({task[4] for task in tasks}), 3)
+        self.assertEqual(tasks, list(batches("postgresql://", 25, 3, 10, "copy", 1)))
@@ -0,0 +1,39 @@
+"""
+Test cases for the serializer registry
+
+"""
+from unittest import TestCase
+from werkzeug.http import parse_accept_header
+from werkzeug.datastructures import MIMEAccept
+from service.common.serializers import SerializerRegistry, JSONSerializer, MsgPackSerializer
+
+
+class CSVSerializer:  # pylint: disable=too-few-public-methods
+    """A format that is not built in"""
+
+    media_type = "text/csv"
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializerRegistry(TestCase):
+    """Test Cases for the serializer registry"""
+
+    def test_negotiate(self):
+        """It should pick the registered serializer the client prefers"""
+        registry = SerializerRegistry()
+        for serializer in (JSONSerializer(), MsgPackSerializer(), CSVSerializer()):
+            registry.register(serializer)
+        self.assertEqual(registry.media_types, ["application/json", "application/msgpack", "text/csv"])
+
+        def negotiate(header):
+            return registry.negotiate(parse_accept_header(header, MIMEAccept)).media_type
+
+        self.assertEqual(negotiate(""), "application/json")
+        self.assertEqual(negotiate("*/*"), "application/json")
+        self.assertEqual(negotiate("text/html"), "application/json")
+        self.assertEqual(negotiate("application/msgpack"), "application/msgpack")
+        self.assertEqual(negotiate("application/json;q=0.5, text/csv"), "text/csv")
+        self.assertIsInstance(registry.get("text/csv"), CSVSerializer)
+        self.assertIsNone(registry.get("text/plain"))
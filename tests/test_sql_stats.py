@@ -0,0 +1,32 @@
+"""
+Test cases for the SQL statistics helpers
+
+"""
+from unittest import TestCase
+from service.common.sql_stats import fingerprint
+
+
+######################################################################
+#  S Q L   S T A T S   T E S T   C A S E S
+######################################################################
+class TestFingerprint(TestCase):
+    """Test Cases for statement fingerprints"""
+
+    def test_replace_literals(self):
+        """It should replace literals and parameters with ?"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM item\n  WHERE order_id = %(order_id_1)s AND title = 'it''s' LIMIT 10"),
+            "SELECT * FROM item WHERE order_id = ? AND title = ? LIMIT ?",
+        )
+        self.assertEqual(fingerprint("SELECT id_1 FROM t2 WHERE a = $1"), "SELECT id_1 FROM t2 WHERE a = ?")
+
+    def test_collapse_lists(self):
+        """It should give IN lists and multi-row VALUES of any length one fingerprint"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM item WHERE id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s)"),
+            fingerprint("SELECT * FROM item WHERE id IN (%(id_1_1)s)"),
+        )
+        self.assertEqual(
+            fingerprint("INSERT INTO item (a, b) VALUES (%(a__0)s, %(b__0)s), (%(a__1)s, %(b__1)s)"),
+            "INSERT INTO item (a, b) VALUES (?)",
+        )